@@ -1,59 +1,290 @@
-from random import randint
+from collections import deque
+from itertools import count
+import secrets
+import sqlite3
+import threading
 import time
 import os
-from flask import Flask, request
+from flask import Flask, request, Response
 
+# The lifetime of a lock, unless ?ttl=<seconds> is given when it is acquired
+# or renewed. A holder which crashes blocks other requests for at most this.
 LOCK_TIMEOUT = int(os.environ.get('LOCK_TIMEOUT', default=600))
+MAX_TTL = int(os.environ.get('MAX_TTL', default=86400))
+# The longest that a request with ?wait=<seconds> is held open
+MAX_WAIT = int(os.environ.get('MAX_WAIT', default=300))
+# Each waiting request occupies one of the server's THREADS (which must match
+# waitress-serve --threads), so at most THREADS - RESERVED_THREADS requests may
+# wait at once, leaving the rest free to serve /unlock and /renew
+THREADS = int(os.environ.get('THREADS', default=32))
+RESERVED_THREADS = int(os.environ.get('RESERVED_THREADS', default=4))
+MAX_WAITERS = max(THREADS - RESERVED_THREADS, 0)
+
+# If set, the held locks are kept in this SQLite file and restored when the
+# service restarts (e.g. on a volume mounted into the container)
+LOCK_DATABASE = os.environ.get('LOCK_DATABASE')
+
+# Upper bounds, in seconds, of the buckets of the wait and hold histograms
+HISTOGRAM_BUCKETS = [0.1, 1, 5, 15, 60, 300, 900, 1800, 3600]
+
+# The resource used by /lock and /unlock, without a name
+DEFAULT_LOCK = 'default'
 
 app = Flask(__name__)
 
-lock_time = None
-keyId = None
+# Independent locks, each {'time': lock_time, 'expires': expiry_time,
+# 'ttl': seconds, 'key': keyId}, by resource name. Times are from
+# time.monotonic, which is not affected by changes to the system clock.
+locks = {}
+# Requests waiting for each lock, in order of arrival
+queues = {}
+tickets = count(1)
+# Requests currently waiting in _lock_req, over all locks
+waiters = 0
+# Counters and histograms for /metrics, by resource name
+metrics = {}
+database = None
+# Guards all of the above, since waitress serves requests from several
+# threads. Notified whenever a lock is released or a waiting request gives up.
+changed = threading.Condition()
+
+def _new_key():
+	# Unpredictable, so that a key cannot be guessed or repeated by chance
+	return secrets.randbits(63)
+
+def _is_held(lock, now):
+	return lock is not None and now < lock['expires']
+
+def _new_histogram():
+	return {'buckets': [0] * len(HISTOGRAM_BUCKETS), 'count': 0, 'sum': 0.0}
+
+def _observe(histogram, value):
+	# Buckets are cumulative, as in the Prometheus format
+	for i, bound in enumerate(HISTOGRAM_BUCKETS):
+		if value <= bound:
+			histogram['buckets'][i] += 1
+	histogram['count'] += 1
+	histogram['sum'] += value
 
-def _lock_req():
-	global lock_time
-	global keyId
-	now = time.time()
-	if lock_time is None:
-		lock_time = now
-		keyId = randint(0,999999)
-		return True, keyId
-	elif (now - lock_time) >= LOCK_TIMEOUT:
-		lock_time = now
-		keyId = randint(0,999999)
-		return True, keyId
-	return False, 0
+def _lock_metrics(name):
+	if name not in metrics:
+		metrics[name] = {'acquisitions': 0, 'contention': 0, 'expirations': 0,
+			'wait': _new_histogram(), 'hold': _new_histogram()}
+	return metrics[name]
+
+def _open_database(path):
+	connection = sqlite3.connect(path, check_same_thread=False)
+	connection.execute('PRAGMA journal_mode=WAL')
+	connection.execute('CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY,'
+		' key INTEGER NOT NULL, ttl REAL NOT NULL, acquired REAL NOT NULL, expires REAL NOT NULL)')
+	connection.commit()
+	return connection
+
+def _restore_locks():
+	# Stored times are from time.time, since time.monotonic does not continue
+	# across a restart of the machine
+	wall_now = time.time()
+	now = time.monotonic()
+	for name, key, ttl, acquired, expires in database.execute('SELECT name, key, ttl, acquired, expires FROM locks'):
+		if expires > wall_now:
+			locks[name] = {'time': now - (wall_now - acquired), 'expires': now + (expires - wall_now), 'ttl': ttl, 'key': key}
+
+def _save_lock(name):
+	# Called after every change to a lock, with changed held
+	if database is None:
+		return
+	lock = locks.get(name)
+	with database:
+		if lock is None:
+			database.execute('DELETE FROM locks WHERE name = ?', (name,))
+		else:
+			offset = time.time() - time.monotonic()
+			database.execute('INSERT OR REPLACE INTO locks VALUES (?, ?, ?, ?, ?)',
+				(name, lock['key'], lock['ttl'], lock['time'] + offset, lock['expires'] + offset))
+
+def _release(name, lock, now):
+	# Records the end of a lock, either unlocked or found to have expired
+	lock_metrics = _lock_metrics(name)
+	if not _is_held(lock, now):
+		lock_metrics['expirations'] += 1
+	_observe(lock_metrics['hold'], min(now, lock['expires']) - lock['time'])
+
+def _ttl_arg():
+	ttl = request.args.get("ttl", type=float, default=None)
+	return None if ttl is None else min(max(ttl, 1), MAX_TTL)
+
+def _lock_req(name=DEFAULT_LOCK, wait=0, ttl=None):
+	# The lock is granted to waiting requests in the order that they arrived,
+	# so a request without wait fails if others are already waiting.
+	# Returns (True, key), or (False, HTTP status) if the lock is unavailable.
+	global waiters
+	ttl = LOCK_TIMEOUT if ttl is None else ttl
+	with changed:
+		# When too many requests are waiting, a request only takes a free lock
+		overloaded = wait > 0 and waiters >= MAX_WAITERS
+		if overloaded:
+			wait = 0
+		deadline = time.monotonic() + wait
+		if wait > 0:
+			waiters += 1
+		queue = queues.setdefault(name, deque())
+		ticket = {'ticket': next(tickets), 'since': time.monotonic()}
+		queue.append(ticket)
+		lock_metrics = _lock_metrics(name)
+		if len(queue) > 1 or _is_held(locks.get(name), ticket['since']):
+			lock_metrics['contention'] += 1
+		try:
+			while True:
+				now = time.monotonic()
+				lock = locks.get(name)
+				if queue[0] is ticket and not _is_held(lock, now):
+					if lock is not None:
+						_release(name, lock, now)
+					keyId = _new_key()
+					locks[name] = {'time': now, 'expires': now + ttl, 'ttl': ttl, 'key': keyId}
+					_save_lock(name)
+					lock_metrics['acquisitions'] += 1
+					_observe(lock_metrics['wait'], now - ticket['since'])
+					return True, keyId
+				if now >= deadline:
+					return False, 503 if overloaded else 409
+				# Wake in time to take over a lock which expires
+				timeout = deadline - now
+				if _is_held(lock, now):
+					timeout = min(timeout, lock['expires'] - now)
+				changed.wait(timeout)
+		finally:
+			if wait > 0:
+				waiters -= 1
+			queue.remove(ticket)
+			if not queue:
+				del queues[name]
+			# The next request in the queue may now take the lock
+			changed.notify_all()
 
 
 @app.route('/lock', methods=['PUT'])
-def lock_req():
-	[success, code] = _lock_req()
+@app.route('/lock/<name>', methods=['PUT'])
+def lock_req(name=DEFAULT_LOCK):
+	wait = min(max(request.args.get("wait", type=float, default=0), 0), MAX_WAIT)
+	[success, code] = _lock_req(name, wait, _ttl_arg())
 	if success:
 		return str(code), 202
+	if code == 503:
+		return "too many waiting requests", 503
 	return "unavailable", 409
 
 
-def _unlock_req(keynum):
-	global lock_time
-	global keyId
-	if(keynum == keyId):
-		lock_time = None
-		keyId = None
-		return True
-	return False
+def _unlock_req(keynum, name=DEFAULT_LOCK):
+	# Returns the response, decided while holding the table lock
+	with changed:
+		lock = locks.get(name)
+		if lock is None:
+			return "no current lock", 409
+		if keynum != lock['key']:
+			return "wrong mutexKey parameter", 401
+		_release(name, lock, time.monotonic())
+		del locks[name]
+		_save_lock(name)
+		changed.notify_all()
+		return "unlocked", 202
 
 
 @app.route('/unlock', methods=['PUT'])
-def unlock_req():
-	global lock_time
+@app.route('/unlock/<name>', methods=['PUT'])
+def unlock_req(name=DEFAULT_LOCK):
 	keynum = request.args.get("mutexKey", type=int, default=-1)
-	unlocked = _unlock_req(keynum)
-	if unlocked:
-		return "unlocked", 202
-	if not lock_time:
-		return "no current lock", 409	
-	return "wrong mutexKey parameter", 401
+	return _unlock_req(keynum, name)
+
+
+def _renew_req(keynum, name=DEFAULT_LOCK, ttl=None):
+	with changed:
+		lock = locks.get(name)
+		if lock is None:
+			return "no current lock", 409
+		if keynum != lock['key']:
+			return "wrong mutexKey parameter", 401
+		now = time.monotonic()
+		if not _is_held(lock, now):
+			# Another request may already have been told that it is free
+			return "lock expired", 409
+		if ttl is not None:
+			lock['ttl'] = ttl
+		lock['expires'] = now + lock['ttl']
+		_save_lock(name)
+		return "renewed", 202
+
+
+@app.route('/renew', methods=['PUT'])
+@app.route('/renew/<name>', methods=['PUT'])
+def renew_req(name=DEFAULT_LOCK):
+	# A heartbeat from the holder, extending the lock by its ttl
+	keynum = request.args.get("mutexKey", type=int, default=-1)
+	return _renew_req(keynum, name, _ttl_arg())
+
+
+@app.route('/locks', methods=['GET'])
+def list_locks():
+	# Only the locks which are currently held (expired locks are free)
+	with changed:
+		now = time.monotonic()
+		return {
+			name: {'held_seconds': round(now - lock['time'], 3), 'expires_in_seconds': round(lock['expires'] - now, 3)}
+			for name, lock in sorted(locks.items()) if _is_held(lock, now)
+		}
+
+
+@app.route('/status', methods=['GET'])
+@app.route('/status/<name>', methods=['GET'])
+def lock_status(name=DEFAULT_LOCK):
+	# Whether the lock is held, and the tickets of the requests waiting for it
+	with changed:
+		now = time.monotonic()
+		lock = locks.get(name)
+		status = {'held': _is_held(lock, now), 'waiting': [
+			{'ticket': t['ticket'], 'waited_seconds': round(now - t['since'], 3)}
+			for t in queues.get(name, [])
+		]}
+		if status['held']:
+			status['held_seconds'] = round(now - lock['time'], 3)
+			status['expires_in_seconds'] = round(lock['expires'] - now, 3)
+	return status
+
+
+def _label(name):
+	return name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_req():
+	# Prometheus text exposition format, with a 'lock' label on each sample.
+	# Expirations are counted when the lock is next requested or unlocked.
+	lines = []
+	with changed:
+		lines += ['# HELP mutex_waiting_requests Number of lock requests currently waiting, over all locks',
+			'# TYPE mutex_waiting_requests gauge', f'mutex_waiting_requests {waiters}']
+		for metric, key, description in [
+				('mutex_acquisitions_total', 'acquisitions', 'Number of times the lock was granted'),
+				('mutex_contention_total', 'contention', 'Number of requests which found the lock held or other requests waiting'),
+				('mutex_expirations_total', 'expirations', 'Number of times the lock expired before it was unlocked')]:
+			lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+			lines += [f'{metric}{{lock="{_label(name)}"}} {m[key]}' for name, m in sorted(metrics.items())]
+		for metric, key, description in [
+				('mutex_wait_seconds', 'wait', 'Time from the lock request until the lock was granted'),
+				('mutex_hold_seconds', 'hold', 'Time from the lock being granted until it was unlocked or expired')]:
+			lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+			for name, m in sorted(metrics.items()):
+				histogram = m[key]
+				label = f'lock="{_label(name)}"'
+				lines += [f'{metric}_bucket{{{label},le="{bound}"}} {n}' for bound, n in zip(HISTOGRAM_BUCKETS, histogram['buckets'])]
+				lines += [f'{metric}_bucket{{{label},le="+Inf"}} {histogram["count"]}',
+					f'{metric}_sum{{{label}}} {histogram["sum"]:.6f}',
+					f'{metric}_count{{{label}}} {histogram["count"]}']
+	return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 
+if LOCK_DATABASE:
+	database = _open_database(LOCK_DATABASE)
+	_restore_locks()
 
 if __name__ == '__main__':
 	app.run(debug=True, host='0.0.0.0', port=8888)
\ No newline at end of file
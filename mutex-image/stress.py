@@ -0,0 +1,119 @@
+#! python3
+# Fires many concurrent lock/unlock requests at the mutex service, checks that
+# no two clients ever hold the same lock, and reports the throughput.
+# By default the requests go to main.app in this process, using Flask's test
+# client, e.g. "python stress.py --clients 64 --cycles 50"
+# With --renew-under-load, it instead starts a waitress server and checks that
+# a lock holder can renew while more requests wait than the server has threads.
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def flaskClient():
+	import main
+	client = main.app.test_client()
+	def put(path):
+		response = client.put(path)
+		return response.status_code, response.get_data(as_text=True)
+	return put
+
+
+def httpClient(url):
+	def put(path):
+		request = urllib.request.Request(url + path, method='PUT')
+		try:
+			with urllib.request.urlopen(request) as response:
+				return response.status, response.read().decode()
+		except urllib.error.HTTPError as e:
+			return e.code, e.read().decode()
+	return put
+
+
+def run(args):
+	holders = {}
+	holdersLock = threading.Lock()
+	violations = []
+	def client(index):
+		put = flaskClient() if args.url is None else httpClient(args.url)
+		name = f'stress_{index % args.locks}'
+		acquired = 0
+		for _ in range(args.cycles):
+			status, key = put(f'/lock/{name}?wait={args.wait}')
+			if status != 202:
+				continue
+			with holdersLock:
+				holders[name] = holders.get(name, 0) + 1
+				if holders[name] > 1:
+					violations.append(name)
+			time.sleep(args.hold)
+			with holdersLock:
+				holders[name] -= 1
+			status, _ = put(f'/unlock/{name}?mutexKey={key}')
+			if status != 202:
+				raise RuntimeError(f'Failed to unlock {name}: {status}')
+			acquired += 1
+		return acquired
+	tic = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=args.clients) as executor:
+		acquired = sum(executor.map(client, range(args.clients)))
+	elapsed = time.perf_counter() - tic
+	requests = args.clients * args.cycles + acquired
+	print(f'{args.clients} clients, {args.locks} locks: {acquired} of {args.clients * args.cycles} acquisitions succeeded')
+	print(f'{requests} requests in {elapsed:0.2f} seconds ({requests / elapsed:0.0f} per second)')
+	if violations:
+		raise RuntimeError(f'Mutual exclusion was violated {len(violations)} times')
+	print('No lock was held by two clients at once')
+
+
+def renewUnderLoad(args):
+	import main
+	from waitress import create_server
+	main.THREADS = args.threads
+	main.MAX_WAITERS = max(args.threads - main.RESERVED_THREADS, 0)
+	server = create_server(main.app, host='127.0.0.1', port=0, threads=args.threads)
+	threading.Thread(target=server.run, daemon=True).start()
+	put = httpClient(f'http://127.0.0.1:{server.effective_port}')
+	name = 'stress_renew'
+	status, key = put(f'/lock/{name}')
+	if status != 202:
+		raise RuntimeError(f'Failed to lock {name}: {status}')
+	def waiter(_):
+		status, waiterKey = put(f'/lock/{name}?wait={args.wait}')
+		if status == 202:
+			put(f'/unlock/{name}?mutexKey={waiterKey}')
+		return status
+	with ThreadPoolExecutor(max_workers=args.clients) as executor:
+		statuses = executor.map(waiter, range(args.clients))
+		# Give the waiters time to reach the server
+		time.sleep(1)
+		tic = time.perf_counter()
+		status, _ = put(f'/renew/{name}?mutexKey={key}')
+		elapsed = time.perf_counter() - tic
+		put(f'/unlock/{name}?mutexKey={key}')
+		statuses = list(statuses)
+	server.close()
+	print(f'{args.clients} waiters, {args.threads} threads: {statuses.count(202)} acquired the lock, {statuses.count(503)} were refused')
+	print(f'Renewed with status {status} in {elapsed:0.3f} seconds')
+	if status != 202 or elapsed > 1:
+		raise RuntimeError('The holder could not renew its lock promptly')
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Stress test the mutex service')
+	parser.add_argument('--url', default=None, help='e.g. http://localhost:8080, instead of the in-process app')
+	parser.add_argument('--clients', type=int, default=32)
+	parser.add_argument('--cycles', type=int, default=100, help='Lock requests made by each client')
+	parser.add_argument('--locks', type=int, default=4, help='Number of lock names shared by the clients')
+	parser.add_argument('--wait', type=float, default=30)
+	parser.add_argument('--hold', type=float, default=0, help='Seconds each lock is held')
+	parser.add_argument('--renew-under-load', action='store_true', help='Check renewing while --clients requests wait for one lock')
+	parser.add_argument('--threads', type=int, default=8, help='Server threads for --renew-under-load')
+	args = parser.parse_args()
+	if args.renew_under_load:
+		renewUnderLoad(args)
+	else:
+		run(args)
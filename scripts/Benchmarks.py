@@ -0,0 +1,739 @@
+#! python3
+# Benchmarks for the pipeline generator, e.g. "py -3 Benchmarks.py parsers"
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+
+from CloneScheduler import syncRepositories
+from FileUtils import writeIfChanged
+import Generate_PPL_Pipelines as generator
+from GitTools import runGitCmd
+
+from MetadataParsers import (
+    parseDependencyList,
+    parseMkVariables,
+    getMkDependencies,
+    parseRepoList,
+    parseVipkgReqsContent,
+)
+import yaml
+from YamlGenerator import (
+    PipelineDefinition,
+    buildYamlObject,
+    updateMinimumVersions,
+    updateFetchDependencies,
+    dumpYamlObject,
+    createConfigDumper,
+    BaseConfigDumper,
+    ConfigDumper,
+    internYamlObject,
+)
+import YamlGenerator
+from Constants import (
+    Target,
+    profileId,
+    labviewDir,
+    create_ppl_dir,
+    ls_currentDir_task,
+    fetch_builder_task,
+    expand_builder_task,
+    ls_task,
+    gcli_build_task,
+)
+from PipelineGenerationUtils import generateFetchPPLJob
+
+
+def bestTime(function, repeats):
+    best = None
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def printComparison(name, legacyTime, newTime):
+    print(
+        f"{name}: {legacyTime * 1000:0.2f} ms -> {newTime * 1000:0.2f} ms"
+        + f" ({legacyTime / newTime:0.1f}x)"
+    )
+
+
+# -------------------------- Parsers -------------------------- #
+def legacyParseMkContent(content, buildObjectName):
+    # The original parser, which built and compiled a pattern per line
+    depVarName = buildObjectName.replace(" ", r"\+").replace(".lvlib", "_Deps")
+    for line in content.splitlines():
+        matchStr = depVarName + r"[ ]?:=[ ]?(.*)$"
+        matchedDeps = re.match(matchStr, line.strip())
+        if matchedDeps:
+            return parseDependencyList(matchedDeps.group(1))
+    return None
+
+
+def legacyParseRepoList(content):
+    repos = []
+    for line in content.splitlines():
+        if line.startswith("#"):
+            continue
+        match = re.match(r"^(.*?)_REPO\s?:=\s?(.*)$", line.strip())
+        if match:
+            repos.append((match.group(1), match.group(2)))
+    return repos
+
+
+def syntheticLibraryNames(numLibraries):
+    return [f"Library {i} Name.lvlib" for i in range(numLibraries)]
+
+
+def syntheticMkContent(libNames, depsPerLibrary):
+    lines = ["# Synthetic dependency declarations"]
+    for i, libName in enumerate(libNames):
+        varName = libName.replace(".lvlib", "").replace(" ", "+")
+        deps = [
+            libNames[(i + j + 1) % len(libNames)].replace(" ", "\\ ") + "p"
+            for j in range(depsPerLibrary)
+        ]
+        lines.append(f"{varName}_Deps := " + " ".join(deps))
+        lines.append(f"{varName}_Sources := $(wildcard {varName}/*.vi)")
+    return "\n".join(lines) + "\n"
+
+
+def syntheticRepoList(libNames):
+    lines = ["# Synthetic repository list"]
+    for i, libName in enumerate(libNames):
+        varName = libName.replace(".lvlib", "").replace(" ", "+")
+        lines.append(f"{varName}_REPO := oist/Repository_{i // 4}")
+    return "\n".join(lines) + "\n"
+
+
+def benchmarkParsers(args):
+    libNames = syntheticLibraryNames(args.variables)
+    mkContent = syntheticMkContent(libNames, args.deps)
+    # Every library in the file is looked up, as for a repository containing
+    # all of them
+    legacyTime, legacyDeps = bestTime(
+        lambda: [legacyParseMkContent(mkContent, lib) for lib in libNames],
+        args.repeats,
+    )
+
+    def parseOnce():
+        variables = parseMkVariables(mkContent)
+        return [getMkDependencies(variables, lib, "synthetic.mk") for lib in libNames]
+
+    newTime, newDeps = bestTime(parseOnce, args.repeats)
+    if legacyDeps != newDeps:
+        raise RuntimeError("The .mk parsers returned different dependencies")
+    print(f"{args.variables} libraries, {args.deps} dependencies each")
+    printComparison(".mk parsing", legacyTime, newTime)
+
+    repoListContent = syntheticRepoList(libNames)
+    legacyTime, legacyRepos = bestTime(
+        lambda: legacyParseRepoList(repoListContent), args.repeats
+    )
+    newTime, newRepos = bestTime(lambda: parseRepoList(repoListContent), args.repeats)
+    if legacyRepos != newRepos:
+        raise RuntimeError("The repoList parsers returned different results")
+    printComparison("repoList parsing", legacyTime, newTime)
+
+    vipmContent = "\n".join(f"# package {i}\nhttps://example/{i}.vip" for i in libNames)
+    newTime, _ = bestTime(lambda: parseVipkgReqsContent(vipmContent), args.repeats)
+    print(f".vipm_reqs parsing: {newTime * 1000:0.2f} ms")
+
+
+# ------------------ LabVIEW version propagation ------------------ #
+class SyntheticPipeline:
+    def __init__(self, dependencies, minVersion):
+        self.dependencies = dependencies
+        self.minVersion = minVersion
+
+
+def syntheticPipelines(numPipelines, fanOut, fractionNewer, seed):
+    # A random acyclic graph: each pipeline depends only on earlier pipelines
+    rng = random.Random(seed)
+    pipelines = {}
+    for i in range(numPipelines):
+        deps = rng.sample(range(i), min(i, rng.randint(0, fanOut)))
+        pipelines[f"Library_{i}.lvlibp"] = SyntheticPipeline(
+            [f"Library_{d}.lvlibp" for d in deps] or None,
+            "2021" if rng.random() < fractionNewer else None,
+        )
+    return pipelines
+
+
+def copyPipelines(pipelines):
+    return {
+        name: SyntheticPipeline(p.dependencies, p.minVersion)
+        for name, p in pipelines.items()
+    }
+
+
+def legacyUpdateMinimumVersions(pipelineDictionary):
+    # The original fixed-point implementation, which supported two versions
+    nonDefaultPipelineNames = [
+        name
+        for name, p in pipelineDictionary.items()
+        if p.minVersion != None and p.minVersion != "2019"
+    ]
+    if len(nonDefaultPipelineNames) == 0:
+        return pipelineDictionary
+    pipelinesToUpdate = set(nonDefaultPipelineNames)
+
+    def dependsOnElems(dependenciesToInclude):
+        def innerFilter(item):
+            itemDependencies = item[1].dependencies
+            if itemDependencies == None:
+                return False
+            return (
+                set(itemDependencies) & set(dependenciesToInclude)
+                and item[0] not in dependenciesToInclude
+            )
+
+        return innerFilter
+
+    while True:
+        newElements = dict(
+            filter(dependsOnElems(pipelinesToUpdate), pipelineDictionary.items())
+        ).keys()
+        pipelinesToUpdate.update(newElements)
+        if len(newElements) == 0:
+            break
+    for name in pipelinesToUpdate:
+        pipelineDictionary[name].minVersion = "2021"
+    return pipelineDictionary
+
+
+def benchmarkVersions(args):
+    pipelines = syntheticPipelines(
+        args.pipelines, args.fan_out, args.fraction_newer, args.seed
+    )
+    # The list of updated pipelines printed by updateMinimumVersions is discarded
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacyTime, legacyResult = bestTime(
+            lambda: legacyUpdateMinimumVersions(copyPipelines(pipelines)),
+            args.repeats,
+        )
+        newTime, newResult = bestTime(
+            lambda: updateMinimumVersions(copyPipelines(pipelines)), args.repeats
+        )
+    legacyVersions = {name: p.minVersion for name, p in legacyResult.items()}
+    newVersions = {name: p.minVersion for name, p in newResult.items()}
+    if legacyVersions != newVersions:
+        raise RuntimeError("The version propagation results are different")
+    print(f"{args.pipelines} pipelines, up to {args.fan_out} dependencies each")
+    printComparison("Version propagation", legacyTime, newTime)
+
+
+# ------------------------ YAML emission ------------------------ #
+def syntheticEntries(numLibraries, fanOut, seed):
+    # Entries in the form produced by handleUrl, with each library in a
+    # repository of four and depending only on earlier libraries
+    rng = random.Random(seed)
+    entries = {}
+    names = [f"Library {i}" for i in range(numLibraries)]
+    for i, name in enumerate(names):
+        pipelineName = name.replace(" ", "-") + ".lvlibp"
+        repoName = f"Repository_{i // 4}"
+        depIndices = rng.sample(range(i), min(i, rng.randint(0, fanOut)))
+        depsNames = [names[d] + ".lvlibp" for d in depIndices]
+        vipkgUrls = [
+            f"https://example.com/packages/package_{rng.randint(0, 20)}.vip"
+            for _ in range(rng.choice([0, 0, 0, 1, 2]))
+        ]
+        entries[pipelineName] = {
+            "artifactId": pipelineName + "_nipkg",
+            "gitUrl": "git@github.com:oist/" + repoName,
+            "libPath": f"{repoName}/{name}/{name}.lvlib",
+            "PPL_Name": name + ".lvlibp",
+            "Dependencies": [d.replace(" ", "-") for d in depsNames] or None,
+            "Dependency PPL Names": depsNames or None,
+            "minLabVIEWVersion": "2021" if rng.random() < 0.02 else None,
+            "vipkgUrls": vipkgUrls or None,
+        }
+    return entries
+
+
+def buildSyntheticYamlObject(entries):
+    pipelineDict = {k: PipelineDefinition(k, v) for k, v in sorted(entries.items())}
+    with contextlib.redirect_stdout(io.StringIO()):
+        updateMinimumVersions(pipelineDict)
+    return buildYamlObject(pipelineDict)
+
+
+def benchmarkEmit(args):
+    yamlObject = buildSyntheticYamlObject(
+        syntheticEntries(args.libraries, args.fan_out, args.seed)
+    )
+    dumpers = {
+        # The original emitter, using PipelineDefinition.to_yaml
+        "yaml.Dumper": yaml.Dumper,
+        "SafeDumper (fallback)": createConfigDumper(yaml.SafeDumper),
+        BaseConfigDumper.__name__: ConfigDumper,
+    }
+    outputs = {}
+    print(f"{args.libraries} libraries")
+    for name, dumper in dumpers.items():
+        elapsed, outputs[name] = bestTime(
+            lambda: dumpYamlObject(yamlObject, None, dumper), args.repeats
+        )
+        print(f"{name}: {elapsed * 1000:0.1f} ms, {len(outputs[name])} characters")
+    if len(set(outputs.values())) != 1:
+        raise RuntimeError("The emitted YAML differs between dumpers")
+    print("All outputs are identical")
+
+
+def benchmarkIntern(args):
+    yamlObject = buildSyntheticYamlObject(
+        syntheticEntries(args.libraries, args.fan_out, args.seed)
+    )
+    original = dumpYamlObject(yamlObject)
+    internTime, internedObject = bestTime(
+        lambda: internYamlObject(yamlObject), args.repeats
+    )
+    interned = dumpYamlObject(internedObject)
+    if yaml.safe_load(original) != yaml.safe_load(interned):
+        raise RuntimeError("Interning changed the content of the configuration")
+    print(f"{args.libraries} libraries, interned in {internTime * 1000:0.1f} ms")
+    print(
+        f"Size: {len(original)} -> {len(interned)} characters"
+        + f" ({100 * len(interned) / len(original):0.1f}%),"
+        + f" {original.count(chr(10))} -> {interned.count(chr(10))} lines"
+    )
+    if args.max_ratio is not None and len(interned) > args.max_ratio * len(original):
+        raise RuntimeError(f"The interned output is larger than {args.max_ratio:0.2f}x")
+
+
+# ------------------------ Job generation ------------------------ #
+def legacyGeneratePPLJobTasksWithDeps(dependencies, vipkgUrls, targetName, lv_version):
+    # The original implementation, building new tasks for every job
+    pplDepTasks = []
+    if dependencies is not None:
+        pplDepTasks.append(create_ppl_dir)
+        for dependency in dependencies:
+            pplDepTasks.append(generateFetchPPLJob(dependency, targetName))
+        pplDepTasks.append(YamlGenerator.mklink_tasks[targetName])
+        pplDepTasks.append(ls_currentDir_task)
+    vipkgTasks = []
+    if vipkgUrls is not None:
+        targetT = Target[targetName]
+        for vipkgUrl in vipkgUrls:
+            vipkgTasks.append(
+                {
+                    "plugin": {
+                        "run_if": "passed",
+                        "options": {
+                            "Url": vipkgUrl,
+                            "LabVIEWDirectory": labviewDir[lv_version][targetT],
+                            "Verbose": False,
+                        },
+                        "configuration": {
+                            "id": "jp.oist.chakraborty.vi-package-installer",
+                            "version": "0.1",
+                        },
+                    }
+                }
+            )
+    return (
+        [fetch_builder_task, expand_builder_task]
+        + pplDepTasks
+        + vipkgTasks
+        + [ls_task, gcli_build_task]
+    )
+
+
+def legacyGeneratePPLJobList(
+    packageRootName, lv_version, dependencies, vipkgUrls, targets
+):
+    ppl_job_list = {}
+    for target in targets:
+        targetT = Target[target]
+        ppl_job_list[target] = {
+            "timeout": 15,
+            "elastic_profile_id": profileId[lv_version][targetT],
+            "environment_variables": YamlGenerator.environmentVariables[targetT],
+            "artifacts": [
+                YamlGenerator.ppl_build_artifact,
+                YamlGenerator.nipkg_build_artifact,
+                {
+                    "external": {
+                        "id": f"{packageRootName}_{target}_nipkg",
+                        "store_id": "cicwin",
+                        "configuration": YamlGenerator.nipkgConfigOptions,
+                    }
+                },
+            ],
+            "tasks": (
+                YamlGenerator.PPLJobTasks_NoDeps
+                if dependencies is None and vipkgUrls is None
+                else legacyGeneratePPLJobTasksWithDeps(
+                    dependencies, vipkgUrls, target, lv_version
+                )
+            ),
+        }
+    return ppl_job_list
+
+
+def measureJobGeneration(pipelineDict, repeats):
+    # Returns the time to build every pipeline, and the configuration written
+    # without and with interning
+    def buildAll():
+        for cache in [
+            YamlGenerator.pplJobTaskLists,
+            YamlGenerator.fetchPPLTasks,
+            YamlGenerator.vipkgTasks,
+        ]:
+            cache.clear()
+        return {name: p.buildData(None) for name, p in pipelineDict.items()}
+
+    buildTime, built = bestTime(buildAll, repeats)
+    yamlObject = buildYamlObject(built)
+    internTime, interned = bestTime(lambda: internYamlObject(yamlObject), repeats)
+    return buildTime, internTime, dumpYamlObject(yamlObject), dumpYamlObject(interned)
+
+
+def benchmarkJobs(args):
+    entries = syntheticEntries(args.libraries, args.fan_out, args.seed)
+    pipelineDict = {k: PipelineDefinition(k, v) for k, v in sorted(entries.items())}
+    with contextlib.redirect_stdout(io.StringIO()):
+        updateMinimumVersions(pipelineDict)
+    matrixGenerator = YamlGenerator.generatePPLJobList
+    YamlGenerator.generatePPLJobList = legacyGeneratePPLJobList
+    try:
+        legacy = measureJobGeneration(pipelineDict, args.repeats)
+    finally:
+        YamlGenerator.generatePPLJobList = matrixGenerator
+    matrix = measureJobGeneration(pipelineDict, args.repeats)
+    if yaml.safe_load(legacy[2]) != yaml.safe_load(matrix[2]):
+        raise RuntimeError("The generated jobs differ")
+    if legacy[3] != matrix[3]:
+        raise RuntimeError("The interned output differs")
+    print(f"{args.libraries} libraries, {len(Target)} targets")
+    printComparison("Building pipelines", legacy[0], matrix[0])
+    printComparison("Interning", legacy[1], matrix[1])
+    print(
+        f"Size without interning: {len(legacy[2])} -> {len(matrix[2])} characters,"
+        + f" with interning: {len(matrix[3])} characters"
+    )
+
+
+# ---------------------- Synthetic repositories ---------------------- #
+def syntheticFleetLibraries(numLibraries, depth, fanOut, vipmFraction, seed):
+    # Libraries are divided into 'depth' layers, and each depends on one
+    # library in the layer below (so the longest chain has 'depth' pipelines)
+    # and on up to fanOut - 1 libraries in any lower layer
+    rng = random.Random(seed)
+    layers = [i * depth // numLibraries for i in range(numLibraries)]
+    firstInLayer = {}
+    for i, layer in enumerate(layers):
+        firstInLayer.setdefault(layer, i)
+    libraries = []
+    for i, layer in enumerate(layers):
+        deps = []
+        if layer > 0:
+            deps.append(rng.randrange(firstInLayer[layer - 1], firstInLayer[layer]))
+            lower = range(firstInLayer[layer])
+            deps += rng.sample(lower, min(len(lower), rng.randint(0, fanOut - 1)))
+        libraries.append(
+            {
+                "name": f"Synthetic Library {i}",
+                "deps": sorted(set(deps)),
+                "vipkgUrls": [
+                    f"https://example.com/packages/package_{rng.randint(0, 20)}.vip"
+                    for _ in range(
+                        rng.randint(1, 2) if rng.random() < vipmFraction else 0
+                    )
+                ],
+                "newerVersion": rng.random() < 0.02,
+            }
+        )
+    return libraries
+
+
+def writeSyntheticRepository(repoDir, libraries, allLibraries, args):
+    for library in libraries:
+        name = library["name"]
+        varName = name.replace(" ", "+")
+        libDir = os.path.join(repoDir, name)
+        os.makedirs(libDir)
+        with open(os.path.join(libDir, name + ".lvlib"), "w") as f:
+            f.write(f'<Library LVVersion="19008000"><Name>{name}</Name></Library>\n')
+        deps = [
+            allLibraries[d]["name"].replace(" ", "\\ ") + ".lvlibp"
+            for d in library["deps"]
+        ]
+        # Libraries without dependencies have no .mk file
+        if deps:
+            lines = [f"{varName}_Deps := " + " ".join(deps)]
+            # Other make variables, which the parser must skip
+            lines += [
+                f"{varName}_Source_{j} := $(wildcard {name}/Subdirectory_{j}/*.vi)"
+                for j in range(args.mk_lines)
+            ]
+            with open(os.path.join(libDir, name + ".mk"), "w") as f:
+                f.write("\n".join(lines) + "\n")
+        if library["vipkgUrls"]:
+            with open(os.path.join(libDir, name + ".vipm_reqs"), "w") as f:
+                f.write("\n".join(library["vipkgUrls"]) + "\n")
+        if library["newerVersion"]:
+            with open(os.path.join(libDir, name + ".min_lv_version"), "w") as f:
+                f.write("2021")
+        # Files which are walked when searching the repository
+        for j in range(args.files_per_library):
+            subDir = os.path.join(libDir, f"Subdirectory_{j % 4}")
+            os.makedirs(subDir, exist_ok=True)
+            with open(os.path.join(subDir, f"VI {j}.vi"), "wb") as f:
+                f.write(b"\0" * 256)
+    gitCmd = ["git", "-C", repoDir]
+    identity = ["-c", "user.name=Benchmark", "-c", "user.email=benchmark@example.com"]
+    runGitCmd(gitCmd + ["init", "-q", "-b", "master"])
+    runGitCmd(gitCmd + ["add", "-A"])
+    runGitCmd(gitCmd + identity + ["commit", "-q", "-m", "Synthetic repository"])
+
+
+def createSyntheticFleet(fleetDir, numLibraries, args):
+    # Returns the path of a repoList.txt naming every library, with file://
+    # URLs. An existing fleet with the same parameters is reused.
+    parameters = {
+        "libraries": numLibraries,
+        "librariesPerRepo": args.libraries_per_repo,
+        "depth": args.depth,
+        "fanOut": args.fan_out,
+        "mkLines": args.mk_lines,
+        "filesPerLibrary": args.files_per_library,
+        "vipmFraction": args.vipm_fraction,
+        "seed": args.seed,
+    }
+    repoListPath = os.path.join(fleetDir, "repoList.txt")
+    parametersPath = os.path.join(fleetDir, "fleet.json")
+    if os.path.exists(parametersPath):
+        with open(parametersPath) as f:
+            if json.load(f) == parameters:
+                return repoListPath
+        raise RuntimeError(f"{fleetDir} contains a fleet with other parameters")
+    libraries = syntheticFleetLibraries(
+        numLibraries, args.depth, args.fan_out, args.vipm_fraction, args.seed
+    )
+    perRepo = args.libraries_per_repo
+    repositories = {
+        Path(fleetDir, "src", f"Repository_{r}").as_posix(): libraries[
+            r * perRepo : (r + 1) * perRepo
+        ]
+        for r in range((numLibraries + perRepo - 1) // perRepo)
+    }
+    tic = time.perf_counter()
+    with ThreadPoolExecutor() as executor:
+        for future in [
+            executor.submit(writeSyntheticRepository, repoDir, libs, libraries, args)
+            for repoDir, libs in repositories.items()
+        ]:
+            future.result()
+    lines = ["# Synthetic repository list"]
+    for repoDir, libs in repositories.items():
+        for library in libs:
+            varName = library["name"].replace(" ", "+")
+            lines.append(f"{varName}_REPO := " + Path(repoDir).as_uri())
+    with open(repoListPath, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(parametersPath, "w") as f:
+        json.dump(parameters, f, indent=1)
+    print(
+        f"Created {len(repositories)} repositories in {time.perf_counter() - tic:0.1f} seconds"
+    )
+    return repoListPath
+
+
+@contextlib.contextmanager
+def measurePhase(phases, name):
+    # Records the duration and the peak memory allocated by Python in this
+    # process (not in the parsing processes) during the phase
+    tracemalloc.reset_peak()
+    startMemory = tracemalloc.get_traced_memory()[0]
+    tic = time.perf_counter()
+    # The progress printed by the generator is discarded
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    phases[name] = {
+        "seconds": time.perf_counter() - tic,
+        "peakMiB": (tracemalloc.get_traced_memory()[1] - startMemory) / 2**20,
+    }
+
+
+def runSyntheticFleet(repoListPath, workDir, args):
+    # The phases of Generate_PPL_Pipelines.py, run one after another rather
+    # than with the clones and parsing overlapped
+    phases = {}
+    cloneDir = os.path.join(workDir, "cloned")
+    with measurePhase(phases, "repoList parse"):
+        urlToLibDict = generator.groupLibrariesByUrl(
+            generator.get_libraries_and_urls(Path(repoListPath))
+        )
+    with measurePhase(phases, "clone"):
+        summaries = list(
+            syncRepositories(urlToLibDict, cloneDir, False, args.clone_workers)
+        )
+    with measurePhase(phases, "metadata scan"):
+        pipelineDict = {}
+        with multiprocessing.Pool(args.parse_workers) as pool:
+            for result in pool.imap_unordered(
+                generator.handleUrlFromTuple,
+                [(s["url"], urlToLibDict[s["url"]], s) for s in summaries],
+            ):
+                for entry in result["entries"]:
+                    for k, v in entry.items():
+                        pipelineDict[k] = PipelineDefinition(k, v)
+        pipelineDict = dict(sorted(pipelineDict.items()))
+    with measurePhase(phases, "graph propagation"):
+        report = generator.getDependencyReport(
+            pipelineDict, generator.defaultJobMinutes
+        )
+        updateMinimumVersions(pipelineDict)
+        updateFetchDependencies(pipelineDict)
+    with measurePhase(phases, "YAML build"):
+        yamlObject = internYamlObject(buildYamlObject(pipelineDict))
+    with measurePhase(phases, "dump"):
+        outputPath = os.path.join(workDir, "LabVIEW_PPL-Pipelines.gocd.yaml")
+        writeIfChanged(outputPath, dumpYamlObject(yamlObject).encode())
+    return phases, report
+
+
+def benchmarkFleet(args):
+    with contextlib.ExitStack() as stack:
+        baseDir = args.work_dir
+        if baseDir is None:
+            baseDir = stack.enter_context(tempfile.TemporaryDirectory())
+        tracemalloc.start()
+        summary = {}
+        for numLibraries in args.libraries:
+            fleetDir = os.path.join(baseDir, f"fleet_{numLibraries}")
+            repoListPath = createSyntheticFleet(fleetDir, numLibraries, args)
+            # Each run starts without clones
+            with tempfile.TemporaryDirectory(dir=baseDir) as workDir:
+                phases, report = runSyntheticFleet(repoListPath, workDir, args)
+            if report["pipelines"] != numLibraries or not report["valid"]:
+                raise RuntimeError("The generated pipelines do not match the fleet")
+            print(
+                f"{numLibraries} libraries, longest chain"
+                + f" {report['longestChain']['length']} pipelines:"
+            )
+            for name, phase in phases.items():
+                print(
+                    f"  {name:<18} {phase['seconds']:8.2f} s {phase['peakMiB']:9.1f} MiB"
+                )
+            total = sum(phase["seconds"] for phase in phases.values())
+            print(f"  {'total':<18} {total:8.2f} s")
+            summary[numLibraries] = phases
+        tracemalloc.stop()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=1)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline generator")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parsersParser = subparsers.add_parser(
+        "parsers", help="Compare the .mk and repoList parsers on synthetic files"
+    )
+    parsersParser.add_argument("--variables", type=int, default=2000)
+    parsersParser.add_argument("--deps", type=int, default=5)
+    parsersParser.add_argument("--repeats", type=int, default=3)
+    parsersParser.set_defaults(function=benchmarkParsers)
+
+    versionsParser = subparsers.add_parser(
+        "versions", help="Compare LabVIEW version propagation on a synthetic graph"
+    )
+    versionsParser.add_argument("--pipelines", type=int, default=2000)
+    versionsParser.add_argument("--fan-out", type=int, default=4)
+    versionsParser.add_argument("--fraction-newer", type=float, default=0.01)
+    versionsParser.add_argument("--seed", type=int, default=1)
+    versionsParser.add_argument("--repeats", type=int, default=3)
+    versionsParser.set_defaults(function=benchmarkVersions)
+
+    emitParser = subparsers.add_parser(
+        "emit", help="Compare YAML emission time and output between dumpers"
+    )
+    emitParser.add_argument("--libraries", type=int, default=500)
+    emitParser.add_argument("--fan-out", type=int, default=3)
+    emitParser.add_argument("--seed", type=int, default=1)
+    emitParser.add_argument("--repeats", type=int, default=3)
+    emitParser.set_defaults(function=benchmarkEmit)
+
+    internParser = subparsers.add_parser(
+        "intern", help="Compare the output size with and without interning"
+    )
+    internParser.add_argument("--libraries", type=int, default=500)
+    internParser.add_argument("--fan-out", type=int, default=3)
+    internParser.add_argument("--seed", type=int, default=1)
+    internParser.add_argument("--repeats", type=int, default=3)
+    internParser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=None,
+        help="Fail if the interned output is larger than this fraction of the original",
+    )
+    internParser.set_defaults(function=benchmarkIntern)
+
+    jobsParser = subparsers.add_parser(
+        "jobs", help="Compare building the per-target jobs with and without sharing"
+    )
+    jobsParser.add_argument("--libraries", type=int, default=500)
+    jobsParser.add_argument("--fan-out", type=int, default=3)
+    jobsParser.add_argument("--seed", type=int, default=1)
+    jobsParser.add_argument("--repeats", type=int, default=3)
+    jobsParser.set_defaults(function=benchmarkJobs)
+
+    fleetParser = subparsers.add_parser(
+        "fleet",
+        help="Time each phase of the generator on synthetic local git repositories",
+    )
+    fleetParser.add_argument(
+        "--libraries", type=int, nargs="+", default=[64, 500, 5000]
+    )
+    fleetParser.add_argument("--libraries-per-repo", type=int, default=4)
+    fleetParser.add_argument(
+        "--depth", type=int, default=8, help="Length of the longest dependency chain"
+    )
+    fleetParser.add_argument("--fan-out", type=int, default=3)
+    fleetParser.add_argument(
+        "--mk-lines",
+        type=int,
+        default=20,
+        help="Number of other variables in each .mk file",
+    )
+    fleetParser.add_argument("--files-per-library", type=int, default=20)
+    fleetParser.add_argument(
+        "--vipm-fraction",
+        type=float,
+        default=0.2,
+        help="Fraction of libraries with a .vipm_reqs file",
+    )
+    fleetParser.add_argument("--seed", type=int, default=1)
+    fleetParser.add_argument("--clone-workers", type=int, default=8)
+    fleetParser.add_argument(
+        "--parse-workers", type=int, default=multiprocessing.cpu_count()
+    )
+    fleetParser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Directory in which the repositories are kept for later runs",
+    )
+    fleetParser.add_argument("--output", help="Write the timings to this JSON file")
+    fleetParser.set_defaults(function=benchmarkFleet)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArguments()
+    args.function(args)
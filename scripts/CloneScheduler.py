@@ -0,0 +1,73 @@
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from FileUtils import directoryFromGitRepo
+from GitTools import cloneRepo, mirrorRepo
+from Tracing import span
+
+
+def syncRepo(gitUrl, baseDir, metadataOnly=False, timeout=None):
+    if metadataOnly:
+        return mirrorRepo(
+            gitUrl, directoryFromGitRepo(gitUrl, baseDir) + ".git", timeout
+        )
+    forceUpdate = False
+    return cloneRepo(
+        gitUrl, directoryFromGitRepo(gitUrl, baseDir), forceUpdate, timeout
+    )
+
+
+def syncRepoWithRetries(
+    gitUrl, baseDir, metadataOnly=False, timeout=None, retries=2, backoff=2.0
+):
+    attempt = 0
+    while True:
+        try:
+            with span("sync repository", repo=gitUrl, attempt=attempt + 1) as info:
+                summary = syncRepo(gitUrl, baseDir, metadataOnly, timeout)
+                info["outcome"] = summary["outcome"]
+            summary["attempts"] = attempt + 1
+            return summary
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            if attempt >= retries:
+                raise RuntimeError(
+                    f"Failed to update {gitUrl} after {attempt + 1} attempts"
+                ) from e
+            delay = backoff * 2**attempt
+            print(f"Retrying {gitUrl} in {delay:0.1f} seconds after error: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+
+def syncRepositories(
+    gitUrls,
+    baseDir,
+    metadataOnly=False,
+    maxWorkers=8,
+    timeout=None,
+    retries=2,
+    backoff=2.0,
+):
+    # Git operations mostly wait on the network or on subprocesses, so threads
+    # (independent of the CPU count) are used rather than processes.
+    # Summaries are yielded in the order that the repositories finish.
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [
+            executor.submit(
+                syncRepoWithRetries,
+                gitUrl,
+                baseDir,
+                metadataOnly,
+                timeout,
+                retries,
+                backoff,
+            )
+            for gitUrl in gitUrls
+        ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # After a failure, don't start any repositories still waiting
+            for future in futures:
+                future.cancel()
@@ -8,6 +8,10 @@ zipPipelineName = "Zip_PPL_Builder"
 zipPipelineStageName = "Zip"
 zipPipelineJobName = "Zip"
 
+# LabVIEW versions which can be given in a .min_lv_version file, in increasing order
+allowedVersionStrings = ["2019", "2021"]
+defaultLabVIEWVersion = allowedVersionStrings[0]
+
 builderMaterial = {
     "pipeline": zipPipelineName,
     "stage": zipPipelineStageName,
@@ -0,0 +1,261 @@
+from collections import deque
+
+
+class DependencyGraph:
+    # Dependencies which are not themselves nodes of the graph (e.g. a typo in
+    # a .mk file) are kept in 'dependencies' but do not form edges
+    def __init__(self, dependencies):
+        # Duplicates in a dependency list are removed, keeping the first
+        self.dependencies = {
+            name: list(dict.fromkeys(deps)) if deps is not None else []
+            for name, deps in dependencies.items()
+        }
+        # Reverse index: for each node, the nodes which directly depend on it
+        self.consumers = {name: [] for name in self.dependencies}
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                if dep in self.consumers:
+                    self.consumers[dep].append(name)
+
+    @classmethod
+    def fromPipelines(cls, pipelineDictionary):
+        return cls({name: p.dependencies for name, p in pipelineDictionary.items()})
+
+    def knownDependencies(self, name):
+        return [dep for dep in self.dependencies[name] if dep in self.consumers]
+
+    def topologicalOrder(self):
+        # Kahn's algorithm, with dependencies before their consumers.
+        # Returns the ordered nodes, and separately any nodes which could not
+        # be ordered because they are part of (or depend on) a cycle.
+        remaining = {
+            name: len(self.knownDependencies(name)) for name in self.dependencies
+        }
+        ready = deque(name for name, count in remaining.items() if count == 0)
+        order = []
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            for consumer in self.consumers[name]:
+                remaining[consumer] -= 1
+                if remaining[consumer] == 0:
+                    ready.append(consumer)
+        ordered = set(order)
+        unordered = [name for name in self.dependencies if name not in ordered]
+        return order, unordered
+
+    def layers(self):
+        # Groups the nodes so that every node's dependencies are in earlier
+        # layers, i.e. each layer can be built in parallel once the previous
+        # layers have been built
+        order, unordered = self.topologicalOrder()
+        if unordered:
+            raise ValueError("Cannot divide a graph with cycles into layers")
+        layerIndex = {}
+        layers = []
+        for name in order:
+            deps = self.knownDependencies(name)
+            index = 1 + max((layerIndex[dep] for dep in deps), default=-1)
+            layerIndex[name] = index
+            if index == len(layers):
+                layers.append([])
+            layers[index].append(name)
+        return layers
+
+    def ancestorPaths(self):
+        # Returns, for each node, every one of its (transitive) dependencies
+        # mapped to the shortest chain through which it is reached, in the
+        # form of a GoCD fetch path "ancestor/.../parent". Each node's paths
+        # are built once, from those of its direct dependencies.
+        order, unordered = self.topologicalOrder()
+        if unordered:
+            raise ValueError("Cannot find the ancestors of nodes in a cycle")
+        paths = {}
+        for name in order:
+            deps = self.knownDependencies(name)
+            nodePaths = {dep: dep for dep in deps}
+            for dep in deps:
+                for ancestor, path in paths[dep].items():
+                    candidate = path + "/" + dep
+                    current = nodePaths.get(ancestor)
+                    if current is None or candidate.count("/") < current.count("/"):
+                        nodePaths[ancestor] = candidate
+            paths[name] = nodePaths
+        return paths
+
+    def consumerIndex(self):
+        # The reverse index with each node's position in a topological order
+        # (nodes in cycles last), which is all that downstream needs. It can be
+        # stored, so that the graph does not have to be built again.
+        order, unordered = self.topologicalOrder()
+        return {
+            "consumers": self.consumers,
+            "position": {name: i for i, name in enumerate(order + unordered)},
+        }
+
+    def propagateMaximum(self, values, rank):
+        # Returns, for each node, the highest-ranked value of that node and
+        # all of its (transitive) dependencies
+        result = dict(values)
+
+        def pullFromDependencies(name):
+            for dep in self.knownDependencies(name):
+                if rank(result[dep]) > rank(result[name]):
+                    result[name] = result[dep]
+
+        order, unordered = self.topologicalOrder()
+        # A single pass suffices when every node's dependencies come first
+        for name in order:
+            pullFromDependencies(name)
+        # Nodes in cycles are relaxed until their values stop changing
+        for name in unordered:
+            pullFromDependencies(name)
+        pending = list(unordered)
+        while pending:
+            name = pending.pop()
+            for consumer in self.consumers[name]:
+                if rank(result[name]) > rank(result[consumer]):
+                    result[consumer] = result[name]
+                    pending.append(consumer)
+        return result
+
+    def danglingDependencies(self):
+        # Dependencies which do not name any pipeline in the graph
+        dangling = {}
+        for name, deps in self.dependencies.items():
+            missing = [dep for dep in deps if dep not in self.consumers]
+            if missing:
+                dangling[name] = missing
+        return dangling
+
+    def findCycles(self):
+        # Tarjan's strongly connected components algorithm (iterative, so
+        # that long chains do not reach the recursion limit)
+        index = {}
+        lowLink = {}
+        stack = []
+        onStack = set()
+        cycles = []
+
+        def visit(name):
+            index[name] = lowLink[name] = len(index)
+            stack.append(name)
+            onStack.add(name)
+            return (name, iter(self.knownDependencies(name)))
+
+        for root in self.dependencies:
+            if root in index:
+                continue
+            work = [visit(root)]
+            while work:
+                name, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        work.append(visit(dep))
+                        break
+                    elif dep in onStack:
+                        lowLink[name] = min(lowLink[name], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowLink[parent] = min(lowLink[parent], lowLink[name])
+                    if lowLink[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            onStack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        if len(component) > 1 or name in self.dependencies[name]:
+                            cycles.append(sorted(component))
+        return cycles
+
+    def longestChain(self):
+        # The longest sequence of pipelines which must be built one after
+        # another, from a pipeline without dependencies to its last consumer.
+        # Pipelines which cannot be ordered (cycles) are not included.
+        order, unordered = self.topologicalOrder()
+        if not order:
+            return []
+        depth = {}
+        previous = {}
+        for name in order:
+            depth[name] = 1
+            previous[name] = None
+            for dep in self.knownDependencies(name):
+                if depth[dep] + 1 > depth[name]:
+                    depth[name] = depth[dep] + 1
+                    previous[name] = dep
+        name = max(order, key=lambda n: depth[n])
+        chain = []
+        while name is not None:
+            chain.append(name)
+            name = previous[name]
+        return list(reversed(chain))
+
+
+def downstream(consumerIndex, names):
+    # The given nodes and every node which (transitively) depends on any of
+    # them, dependencies first. Only the affected part of the reverse index
+    # (see DependencyGraph.consumerIndex) is visited.
+    consumers = consumerIndex["consumers"]
+    found = set()
+    pending = [name for name in names if name in consumers]
+    while pending:
+        name = pending.pop()
+        if name not in found:
+            found.add(name)
+            pending.extend(consumers[name])
+    return sorted(found, key=consumerIndex["position"].__getitem__)
+
+
+def missingTargets(graph, targetsPerPipeline):
+    # A pipeline fetches its dependencies' packages for each of its own
+    # targets, so each dependency must build (at least) the same targets.
+    # Returns {consumer: {dependency: [targets it does not build]}}
+    missing = {}
+    for name in graph.dependencies:
+        for dep in graph.knownDependencies(name):
+            absent = [
+                t for t in targetsPerPipeline[name] if t not in targetsPerPipeline[dep]
+            ]
+            if absent:
+                missing.setdefault(name, {})[dep] = absent
+    return missing
+
+
+def dependencyReport(graph, targetsPerPipeline, jobMinutes, agents=None):
+    # targetsPerPipeline gives the names of the jobs run (in parallel) by each
+    # pipeline's build stage, each of which is assumed to take jobMinutes
+    cycles = graph.findCycles()
+    dangling = graph.danglingDependencies()
+    targetsMissing = missingTargets(graph, targetsPerPipeline)
+    chain = graph.longestChain()
+    jobsPerTarget = {}
+    for targets in targetsPerPipeline.values():
+        for target in targets:
+            jobsPerTarget[target] = jobsPerTarget.get(target, 0) + 1
+    totalJobs = sum(jobsPerTarget.values())
+    estimatedMinutes = {
+        "criticalPath": len(chain) * jobMinutes,
+        "totalAgentTime": totalJobs * jobMinutes,
+    }
+    if agents:
+        # Limited by either the longest chain or the available agents
+        estimatedMinutes["withAgents"] = max(
+            estimatedMinutes["criticalPath"], totalJobs * jobMinutes / agents
+        )
+    return {
+        "valid": not cycles and not dangling and not targetsMissing,
+        "pipelines": len(graph.dependencies),
+        "cycles": cycles,
+        "danglingDependencies": dangling,
+        "missingTargets": targetsMissing,
+        "longestChain": {"length": len(chain), "pipelines": chain},
+        "jobs": {"total": totalJobs, "perTarget": jobsPerTarget},
+        "jobMinutes": jobMinutes,
+        "agents": agents,
+        "estimatedMinutes": estimatedMinutes,
+    }
@@ -1,27 +1,80 @@
 import os
-import contextlib
+import hashlib
 import re
 from pathlib import Path
 
 
-@contextlib.contextmanager
-def pushd(new_dir):
-    prev_dir = os.getcwd()
-    os.chdir(new_dir)
-    yield
-    os.chdir(prev_dir)
-
-
-def find_file(filename, top_directory, absolute=True):
-    for dirpath, dirnames, files in os.walk(top_directory):
-        for file in files:
-            if file == filename:
-                return (
-                    os.path.join(dirpath, file)
-                    if absolute
-                    else os.path.relpath(os.path.join(dirpath, file), top_directory)
-                )
-    return None
+class FileIndex:
+    # Maps each filename in a directory tree to its first occurrence, so that
+    # repeated lookups in the same clone need only a single traversal.
+    # The traversal order matches os.walk when scanning.
+    def __init__(self, top_directory, relativePaths=None):
+        self.top_directory = top_directory
+        self.filesScanned = 0
+        # Content read by blobSha and readFiles
+        self.bytesRead = 0
+        self._paths = {}
+        if relativePaths is None:
+            self._scan()
+        else:
+            # e.g. the output of 'git ls-files', with '/' separated paths
+            for relPath in relativePaths:
+                self.filesScanned += 1
+                self._paths.setdefault(relPath.rsplit("/", 1)[-1], relPath)
+
+    def _scan(self):
+        stack = [""]
+        while stack:
+            relDir = stack.pop()
+            subdirs = []
+            with os.scandir(os.path.join(self.top_directory, relDir)) as entries:
+                for entry in entries:
+                    relPath = os.path.join(relDir, entry.name)
+                    if entry.is_dir():
+                        # Like os.walk, do not follow symlinks to directories
+                        if entry.name != ".git" and not entry.is_symlink():
+                            subdirs.append(relPath)
+                    else:
+                        self.filesScanned += 1
+                        self._paths.setdefault(entry.name, relPath)
+            stack.extend(reversed(subdirs))
+
+    def find(self, filename, absolute=True):
+        relPath = self._paths.get(filename)
+        if relPath is None:
+            return None
+        return (
+            os.path.normpath(os.path.join(self.top_directory, relPath))
+            if absolute
+            else os.path.normpath(relPath)
+        )
+
+    def blobSha(self, relPath):
+        # The SHA that git would give the file's content
+        with open(os.path.join(self.top_directory, relPath), "rb") as f:
+            content = f.read()
+        self.bytesRead += len(content)
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def readFiles(self, relPaths):
+        contents = {}
+        for relPath in relPaths:
+            with open(os.path.join(self.top_directory, relPath), "r") as f:
+                self.bytesRead += os.fstat(f.fileno()).st_size
+                contents[relPath] = f.read()
+        return contents
+
+
+def writeIfChanged(path, data):
+    # Returns True if the file was written, or False if it already contained data
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            existingHash = hashlib.sha256(f.read()).digest()
+        if existingHash == hashlib.sha256(data).digest():
+            return False
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
 
 
 directoryNameMatcher = re.compile(r"^.*:.*/(.*)$")
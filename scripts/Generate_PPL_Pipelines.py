@@ -1,19 +1,51 @@
 #! python3
+import argparse
+import contextlib
+import json
+import locale
 import multiprocessing
-import re
 import os
 from pathlib import Path
+import sys
 import time
-import yaml
-
-from GitTools import cloneRepo
-from FileUtils import find_file, pushd, directoryFromGitRepo
-from YamlGenerator import PipelineDefinition, buildYamlObject, updateMinimumVersions
-from NameTransformers import (
-    sanitizeForPipelineName,
-    parseMkfileTargetToName,
-    parseMkFile,
-    parseVipkgReqsFile,
+
+from GitTools import listTrackedFiles, GitTreeIndex
+from CloneScheduler import syncRepositories
+from FileUtils import FileIndex, directoryFromGitRepo, writeIfChanged
+from Constants import allowedVersionStrings, defaultLabVIEWVersion, Target
+from DependencyGraph import DependencyGraph, dependencyReport, downstream
+from YamlGenerator import (
+    PipelineDefinition,
+    buildYamlObject,
+    updateMinimumVersions,
+    updateFetchDependencies,
+    generateBuildPlan,
+    generateRebuildAllPipeline,
+    rebuildAllPipelineName,
+    dumpYamlObject,
+    internYamlObject,
+)
+from RepoState import (
+    loadRepoState,
+    saveRepoState,
+    isStateCurrent,
+    loadConsumerIndex,
+    saveConsumerIndex,
+)
+from NameTransformers import sanitizeForPipelineName, parseMkfileTargetToName
+from MetadataParsers import parseRepoList, getMkDependencies, parseMetadataContent
+from MetadataCache import MetadataCache
+from Tracing import (
+    span,
+    takeSpans,
+    addSpans,
+    resetSpans,
+    traceWriters,
+    summarizeSpans,
+    profileCall,
+    profileWorkerCall,
+    enableWorkerProfiling,
+    addProfileStats,
 )
 
 
@@ -21,32 +53,32 @@ def get_libraries_and_urls(path):
     if not path.exists():
         raise RuntimeError(f"Bad path passed to get_libraries_and_urls: {path}")
     print("Getting libraries and URLs from file: " + str(path))
-    matcher = re.compile(r"^(.*?)_REPO\s?:=\s?(.*)$")
     repos = {}
-    file = open(path)
-    for line in file.readlines():
-        if line.startswith("#"):
-            continue
-        line = line.strip()
-        match = matcher.match(line)
-        if match:
-            libraryName = match.group(1)
-            repoUrl = match.group(2)
-            pipelineName = sanitizeForPipelineName(libraryName)
-            userLibraryName = parseMkfileTargetToName(libraryName)
-            if repoUrl.startswith("oist/"):
-                repoUrl = "git@github.com:" + repoUrl
-            repos[pipelineName] = {
-                "url": repoUrl,
-                "filename": userLibraryName + ".lvlib",
-            }
+    with open(path) as file:
+        content = file.read()
+    for libraryName, repoUrl in parseRepoList(content):
+        pipelineName = sanitizeForPipelineName(libraryName)
+        userLibraryName = parseMkfileTargetToName(libraryName)
+        if repoUrl.startswith("oist/"):
+            repoUrl = "git@github.com:" + repoUrl
+        repos[pipelineName] = {
+            "url": repoUrl,
+            "filename": userLibraryName + ".lvlib",
+        }
 
-    file.close()
     print("Parsed repository list")
     print()
     return repos
 
 
+def groupLibrariesByUrl(entries):
+    # Returns the library file names in each repository, in repoList order
+    urlToLibDict = dict()
+    for d in entries.values():
+        urlToLibDict.setdefault(d["url"], []).append(d["filename"])
+    return urlToLibDict
+
+
 def generateEntryDictionary(
     pipelineName,
     gitUrl,
@@ -56,6 +88,8 @@ def generateEntryDictionary(
     DependencyPPLNames,
     minLabVIEWVersion,
     vipkgUrls,
+    targets=None,
+    labVIEWVersions=None,
 ):
     return {
         pipelineName: {
@@ -67,47 +101,134 @@ def generateEntryDictionary(
             "Dependency PPL Names": DependencyPPLNames,
             "minLabVIEWVersion": minLabVIEWVersion,
             "vipkgUrls": vipkgUrls,
+            "targets": targets,
+            "labVIEWVersions": labVIEWVersions,
         }
     }
 
 
-allowedVersionStrings = ["2019", "2021"]
+def getBuildConfig(buildConfig, buildConfigPath):
+    # Returns the targets and LabVIEW versions declared in a .build_config file
+    # (each None if not restricted), in the order of Target and
+    # allowedVersionStrings
+    unknownVariables = set(buildConfig) - {"Targets", "LabVIEW_Versions"}
+    if unknownVariables:
+        raise RuntimeError(
+            f"Unknown variables in {buildConfigPath}: {sorted(unknownVariables)}"
+        )
+    targets = buildConfig.get("Targets")
+    if targets is not None:
+        invalid = set(targets) - set(Target._member_names_)
+        if invalid or not targets:
+            raise RuntimeError(f"Invalid targets in {buildConfigPath}: {targets}")
+        targets = [t for t in Target._member_names_ if t in targets]
+    versions = buildConfig.get("LabVIEW_Versions")
+    if versions is not None:
+        invalid = set(versions) - set(allowedVersionStrings)
+        if invalid or not versions:
+            raise RuntimeError(
+                f"Invalid LabVIEW versions in {buildConfigPath}: {versions}"
+            )
+        versions = [v for v in allowedVersionStrings if v in versions]
+    return targets, versions
+
+
+# Estimated duration of a PPL build job, for the dependency report
+defaultJobMinutes = 10
 
 
-def handleUrl(gitUrl, libNames, baseDir):
-    outputDir = directoryFromGitRepo(gitUrl, baseDir)
+def handleUrl(
+    gitUrl,
+    libNames,
+    updateSummary,
+    cachedState=None,
+    useGitFileList=False,
+    metadataOnly=False,
+    metadataCachePath=None,
+    gitTimeout=None,
+):
+    # The repository has already been cloned or updated, see CloneScheduler
     gitDir = directoryFromGitRepo(gitUrl, None)
-    # print(f"{gitUrl}: {libNames}, baseDir: {baseDir}")
-    forceUpdate = False
-    cloneResponse = cloneRepo(gitUrl, outputDir, forceUpdate)
-    retVals = []
+    outputDir = updateSummary["directory"]
+    # print(f"{gitUrl}: {libNames}, outputDir: {outputDir}")
+    headSha = updateSummary["sha"]
+    if isStateCurrent(cachedState, headSha, libNames):
+        # Nothing has changed in this repository since the last run
+        return generateRepoResult(
+            gitUrl, headSha, libNames, cachedState["entries"], updateSummary
+        )
+    # A single traversal of the clone serves every lookup for every library
+    with span("index files", repo=gitUrl):
+        if metadataOnly:
+            fileIndex = GitTreeIndex(outputDir, timeout=gitTimeout)
+        else:
+            fileIndex = FileIndex(
+                outputDir, listTrackedFiles(outputDir) if useGitFileList else None
+            )
+    libFiles = {}
     for libName in libNames:
-        libPathPartial = find_file(libName, outputDir, False)
+        libPathPartial = fileIndex.find(libName, False)
         if not libPathPartial:
-            raise FileNotFoundError("Could not find " + libName + " in " + str(baseDir))
-        libPath = os.path.join(gitDir, libPathPartial).replace(os.sep, "/")
-        mkFilePath = find_file(libName.replace(".lvlib", ".mk"), outputDir)
-        minVerPath = find_file(libName.replace(".lvlib", ".min_lv_version"), outputDir)
-        vipkgReqsPath = find_file(libName.replace(".lvlib", ".vipm_reqs"), outputDir)
+            raise FileNotFoundError("Could not find " + libName + " in " + outputDir)
+        libFiles[libName] = {
+            "lvlib": libPathPartial,
+            "mk": fileIndex.find(libName.replace(".lvlib", ".mk"), False),
+            "min_lv_version": fileIndex.find(
+                libName.replace(".lvlib", ".min_lv_version"), False
+            ),
+            "vipm_reqs": fileIndex.find(libName.replace(".lvlib", ".vipm_reqs"), False),
+            "build_config": fileIndex.find(
+                libName.replace(".lvlib", ".build_config"), False
+            ),
+        }
+    metadataPaths = {
+        path: kind
+        for files in libFiles.values()
+        for kind, path in files.items()
+        if kind != "lvlib" and path is not None
+    }
+    # Several libraries can share one .mk file, which is only parsed once
+    with span("parse metadata", repo=gitUrl, files=len(metadataPaths)):
+        parsed, cacheHits = parseMetadataFiles(
+            fileIndex, metadataPaths, metadataCachePath
+        )
+    retVals = []
+    for libName, files in libFiles.items():
+        libPath = os.path.join(gitDir, files["lvlib"]).replace(os.sep, "/")
+        mkFilePath = files["mk"]
+        minVerPath = files["min_lv_version"]
+        vipkgReqsPath = files["vipm_reqs"]
+        buildConfigPath = files["build_config"]
         pipelineName = sanitizeForPipelineName(libName) + "p"
         PPL_Name = libName + "p"
         minLabVIEWVersion = None
         if minVerPath != None:
-            f = open(minVerPath, "r")
-            content = f.read()
-            f.close()
+            content = parsed[minVerPath]
             if content in allowedVersionStrings:
                 minLabVIEWVersion = content
             else:
                 raise RuntimeError("Invalid minimum LabVIEW version: " + content)
+        targets = None
+        labVIEWVersions = None
+        if buildConfigPath != None:
+            targets, labVIEWVersions = getBuildConfig(
+                parsed[buildConfigPath], os.path.join(outputDir, buildConfigPath)
+            )
+            # The library is built with at least the oldest version it supports
+            if labVIEWVersions is not None and allowedVersionStrings.index(
+                labVIEWVersions[0]
+            ) > allowedVersionStrings.index(minLabVIEWVersion or defaultLabVIEWVersion):
+                minLabVIEWVersion = labVIEWVersions[0]
         depsNames = None
         depsList = None
         vipkgUrls = None
         if mkFilePath != None:
-            depsNames = parseMkFile(mkFilePath, libName)
+            depsNames = getMkDependencies(
+                parsed[mkFilePath], libName, os.path.join(outputDir, mkFilePath)
+            )
             depsList = list(map(sanitizeForPipelineName, depsNames))
         if vipkgReqsPath != None:
-            vipkgUrls = parseVipkgReqsFile(vipkgReqsPath)
+            vipkgUrls = parsed[vipkgReqsPath]
         retVals.append(
             generateEntryDictionary(
                 pipelineName,
@@ -118,65 +239,575 @@ def handleUrl(gitUrl, libNames, baseDir):
                 depsNames,
                 minLabVIEWVersion,
                 vipkgUrls,
+                targets,
+                labVIEWVersions,
             )
         )
-    return retVals
+    result = generateRepoResult(
+        gitUrl, headSha, libNames, retVals, updateSummary, False
+    )
+    result["metadataCacheHits"] = cacheHits
+    result["filesScanned"] = fileIndex.filesScanned
+    result["bytesRead"] = fileIndex.bytesRead
+    return result
 
 
-def printFlatDict(flat_dict):
-    for key, value in flat_dict.items():
-        print(key, ":", value)
+def parseMetadataFiles(fileIndex, metadataPaths, metadataCachePath=None):
+    # Returns the parsed content of each file, and the number of files which
+    # were found in the cache. Files are read in one batch per kind.
+    if metadataCachePath is None:
+        contents = fileIndex.readFiles(list(metadataPaths))
+        return {
+            path: parseMetadataContent(kind, contents[path])
+            for path, kind in metadataPaths.items()
+        }, 0
+    blobShas = {path: fileIndex.blobSha(path) for path in metadataPaths}
+    parsed = {}
+    cacheHits = 0
+    with MetadataCache(metadataCachePath) as cache:
+        for kind in sorted(set(metadataPaths.values())):
+            paths = [path for path, k in metadataPaths.items() if k == kind]
+            results = cache.getMany(kind, [blobShas[path] for path in paths])
+            missing = [path for path in paths if blobShas[path] not in results]
+            cacheHits += len(paths) - len(missing)
+            contents = fileIndex.readFiles(missing)
+            newResults = {
+                blobShas[path]: parseMetadataContent(kind, contents[path])
+                for path in missing
+            }
+            cache.putMany(kind, newResults)
+            results.update(newResults)
+            for path in paths:
+                parsed[path] = results[blobShas[path]]
+    return parsed, cacheHits
 
 
-def flatten_dict(input):
-    return {k: v for d in input for k, v in d.items()}
+def generateRepoResult(
+    gitUrl, headSha, libNames, entries, updateSummary, fromCache=True
+):
+    return {
+        "url": gitUrl,
+        "sha": headSha,
+        "libNames": libNames,
+        "entries": entries,
+        "update": updateSummary,
+        "fromCache": fromCache,
+    }
 
 
-if __name__ == "__main__":
+def handleUrlFromTuple(handleUrlArgs):
+    # Run in the parsing processes, which return their timing spans (and with
+    # --profile, their profile statistics) to the parent with each result
+    gitUrl, _, updateSummary = handleUrlArgs[:3]
+    with span("handleUrl", repo=gitUrl, update=updateSummary["outcome"]) as info:
+        result, profileStats = profileWorkerCall(handleUrl, *handleUrlArgs)
+        info["fromCache"] = result["fromCache"]
+        for key in ["filesScanned", "bytesRead", "metadataCacheHits"]:
+            if key in result:
+                info[key] = result[key]
+    result["spans"] = takeSpans()
+    result["profile"] = profileStats
+    return result
+
+
+def printUpdateSummary(updateSummaries):
+    outcomes = {}
+    for summary in updateSummaries:
+        outcomes[summary["outcome"]] = outcomes.get(summary["outcome"], 0) + 1
+    print(
+        "Repository updates: "
+        + ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+    )
+    for summary in sorted(updateSummaries, key=lambda s: s["seconds"], reverse=True):
+        print(
+            f"  {summary['seconds']:7.2f}s  {summary['outcome']:<14}  {summary['url']}"
+        )
+
+
+def initializeParseWorker(stdoutToStderr, profile=False):
+    resetSpans()
+    enableWorkerProfiling(profile)
+    # A redirection of the parent's stdout is not inherited by processes
+    # started with 'spawn' (the default on Windows)
+    if stdoutToStderr:
+        sys.stdout = sys.stderr
+
+
+def collectPipelineDefinitions(args, stdoutToStderr=False):
     this_dir = os.path.dirname((lambda x: x).__code__.co_filename)
     repoListPath = Path(this_dir, "repoList.txt")
-    entries = get_libraries_and_urls(repoListPath)
-    unique_repo_urls = set(d["url"] for d in entries.values())
-    urlToLibDict = dict()
-    for url in unique_repo_urls:
-        libNames = list(d["filename"] for d in entries.values() if d["url"] == url)
-        urlToLibDict[url] = libNames
+    with span("parse repoList"):
+        urlToLibDict = groupLibrariesByUrl(get_libraries_and_urls(repoListPath))
     tic_start = time.perf_counter()
-    processes: list[multiprocessing.Process] = []
     outputDirectory = os.path.join(Path.cwd(), "cloned")
-    forceUpdate = False
+    stateFilePath = os.path.join(outputDirectory, "repoState.json")
+    metadataCachePath = None
+    if args.no_cache or args.rebuild_cache:
+        # Every repository is parsed again
+        repoState = {}
+    else:
+        repoState = loadRepoState(stateFilePath)
+    if not args.no_cache:
+        metadataCachePath = os.path.join(outputDirectory, "metadataCache.sqlite")
+        os.makedirs(outputDirectory, exist_ok=True)
+        with MetadataCache(metadataCachePath, args.cache_max_entries) as cache:
+            if args.rebuild_cache:
+                cache.clear()
+    cloneSummaries = syncRepositories(
+        urlToLibDict.keys(),
+        outputDirectory,
+        args.metadata_only,
+        args.clone_workers,
+        args.clone_timeout,
+        args.clone_retries,
+    )
+    # Each repository is handed to the parsing processes as soon as its clone
+    # completes, rather than waiting for the slowest clone
     generator = (
-        (keyname, list(value), outputDirectory)
-        for keyname, value in urlToLibDict.items()
+        (
+            summary["url"],
+            urlToLibDict[summary["url"]],
+            summary,
+            repoState.get(summary["url"]),
+            args.git_file_list,
+            args.metadata_only,
+            metadataCachePath,
+            args.clone_timeout,
+        )
+        for summary in cloneSummaries
     )
-    with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
-        results = pool.starmap(handleUrl, generator)
+    results = {}
+    pipelineDefinitions = {}
+    with span("clone and parse", repositories=len(urlToLibDict)), multiprocessing.Pool(
+        args.parse_workers,
+        initializer=initializeParseWorker,
+        initargs=(stdoutToStderr, args.profile),
+    ) as pool:
+        for result in pool.imap_unordered(handleUrlFromTuple, generator):
+            results[result["url"]] = result
+            addSpans(result.pop("spans"))
+            addProfileStats(result.pop("profile"))
+            for entry in result["entries"]:
+                for k, v in entry.items():
+                    pipelineDefinitions[k] = PipelineDefinition(k, v)
 
     toc_end = time.perf_counter()
-    print(f"Cloned all repositories in {toc_end-tic_start:0.2f} seconds")
-    list_dicts = [item for sublist in results for item in sublist]
-    flat_dict = {k: v for d in list_dicts for k, v in d.items()}
-    # printFlatDict(flat_dict)
-    # print("------")
-    no_deps_entries = {k: v for k, v in flat_dict.items() if v["Dependencies"] == None}
-    deps_entries = {k: v for k, v in flat_dict.items() if v["Dependencies"] != None}
-
-    pipelineDefinitionContent = []
-    for k, v in flat_dict.items():
-        pipelineDefinitionContent.append({k: PipelineDefinition(k, v)})
+    print(f"Cloned and parsed all repositories in {toc_end-tic_start:0.2f} seconds")
+    numParsed = sum(1 for r in results.values() if not r["fromCache"])
+    print(
+        f"Parsed {numParsed} changed repositories, {len(results) - numParsed} unchanged"
+    )
+    if metadataCachePath is not None:
+        cacheHits = sum(r.get("metadataCacheHits", 0) for r in results.values())
+        print(f"Found {cacheHits} metadata files in the cache")
+        with MetadataCache(metadataCachePath, args.cache_max_entries) as cache:
+            cache.evict()
+    updateSummaries = [results[url]["update"] for url in sorted(results)]
+    printUpdateSummary(updateSummaries)
+    with open(os.path.join(outputDirectory, "updateSummary.json"), "w") as f:
+        json.dump(updateSummaries, f, indent=1)
+    # Only repositories still in the repoList are kept in the state file
+    stateKeys = ["url", "sha", "libNames", "entries"]
+    if not args.no_cache:
+        with span("save state"):
+            saveRepoState(
+                stateFilePath,
+                {url: {k: r[k] for k in stateKeys} for url, r in results.items()},
+            )
+
     # Sort to ensure the same order on repeated execution
     # This also helps reduce git diffs
-    pipelineDict = dict(sorted(flatten_dict(pipelineDefinitionContent).items()))
-    updateMinimumVersions(pipelineDict)
-
     # The behaviour of the sort might depend on Python version -
     # dictionary insertion order is preserved after Python 3.7
-    yamlObject = buildYamlObject(pipelineDict)
-    # print(yaml.dump(yamlObject, sort_keys=False))
+    pipelineDefinitions = dict(sorted(pipelineDefinitions.items()))
+    with span("save consumer index"):
+        saveConsumerIndex(
+            os.path.join(outputDirectory, consumerIndexFileName),
+            pipelineAliases(pipelineDefinitions),
+            DependencyGraph.fromPipelines(pipelineDefinitions).consumerIndex(),
+        )
+    return pipelineDefinitions
+
+
+consumerIndexFileName = "consumerIndex.json"
+
+
+def getDependencyReport(pipelineDict, jobMinutes, agents=None):
+    graph = DependencyGraph.fromPipelines(pipelineDict)
+    targetsPerPipeline = {name: p.targets for name, p in pipelineDict.items()}
+    report = dependencyReport(graph, targetsPerPipeline, jobMinutes, agents)
+    # Pipelines which would need a LabVIEW version that they do not support,
+    # because of the version required by a dependency
+    requiredVersions = graph.propagateMaximum(
+        {
+            name: p.minVersion or defaultLabVIEWVersion
+            for name, p in pipelineDict.items()
+        },
+        allowedVersionStrings.index,
+    )
+    report["unsupportedVersions"] = {
+        name: requiredVersions[name]
+        for name, p in pipelineDict.items()
+        if requiredVersions[name] not in p.labVIEWVersions
+    }
+    report["valid"] = report["valid"] and not report["unsupportedVersions"]
+    return report
+
+
+def generateCommand(args):
+    pipelineDict = collectPipelineDefinitions(args)
+    writeConfigFile(pipelineDict, args)
+    return 0
+
+
+def writeConfigFile(pipelineDict, args):
+    # Problems in the dependency graph would otherwise only be found by the
+    # GoCD server after the configuration is pushed
+    with span("validate", pipelines=len(pipelineDict)):
+        report = getDependencyReport(pipelineDict, defaultJobMinutes)
+    if not report["valid"]:
+        raise RuntimeError(
+            "Invalid dependencies: "
+            + json.dumps(
+                {
+                    k: report[k]
+                    for k in [
+                        "cycles",
+                        "danglingDependencies",
+                        "missingTargets",
+                        "unsupportedVersions",
+                    ]
+                },
+                indent=1,
+            )
+        )
+    with span("propagate versions"):
+        updateMinimumVersions(pipelineDict)
+    with span("find fetched packages"):
+        updateFetchDependencies(pipelineDict, args.fetch == "transitive")
 
-    outputFilePath = "./LabVIEW_PPL-Pipelines.gocd.yaml"
-    with open(outputFilePath, "w") as outputFile:
-        yaml.dump(
-            yamlObject, outputFile, sort_keys=False, width=999999, line_break="\r\n"
+    shards = splitPipelines(pipelineDict, args.split_by)
+    if args.build_plan or args.rebuild_all_pipeline:
+        with span("plan build waves"):
+            buildPlan = generateBuildPlan(pipelineDict)
+        if args.build_plan:
+            with open(args.build_plan, "w") as f:
+                json.dump(buildPlan, f, indent=1)
+            print(
+                f"{args.build_plan}: {len(buildPlan['waves'])} waves"
+                + f" of {buildPlan['pipelines']} pipelines"
+            )
+        if args.rebuild_all_pipeline:
+            # In a file of its own, whichever way the pipelines are split
+            shards.append(
+                (
+                    "Rebuild_All",
+                    {rebuildAllPipelineName: generateRebuildAllPipeline(buildPlan)},
+                )
+            )
+
+    outputDirectory = args.output_dir
+    os.makedirs(outputDirectory, exist_ok=True)
+    writtenFiles = set()
+    for shardName, shardPipelines in shards:
+        with span("build YAML", shard=shardName, pipelines=len(shardPipelines)):
+            yamlObject = buildYamlObject(shardPipelines)
+            # print(yaml.dump(yamlObject, sort_keys=False))
+            if not args.no_intern:
+                yamlObject = internYamlObject(yamlObject)
+        with span("dump YAML", shard=shardName) as info:
+            # Encoded as it would be by a file opened with open(path, "w")
+            content = dumpYamlObject(yamlObject).replace("\n", os.linesep)
+            data = content.encode(locale.getpreferredencoding(False))
+            info["bytes"] = len(data)
+        outputFileName = configFilePrefix + shardName + configFileSuffix
+        with span("write", file=outputFileName):
+            written = writeIfChanged(
+                os.path.join(outputDirectory, outputFileName), data
+            )
+        writtenFiles.add(outputFileName)
+        print(
+            f"{outputFileName}: {len(data)} bytes"
+            + ("" if written else " (unchanged, not written)")
         )
-    print(str(os.path.getsize(outputFilePath)) + " bytes")
+    # Remove files from a previous run with a different set of shards, which
+    # would otherwise define the same pipelines twice
+    for fileName in sorted(os.listdir(outputDirectory)):
+        if (
+            fileName.startswith(configFilePrefix)
+            and fileName.endswith(configFileSuffix)
+            and fileName not in writtenFiles
+        ):
+            print(f"Removing {fileName}, which is no longer generated")
+            os.remove(os.path.join(outputDirectory, fileName))
+
+
+# Generated files are named <prefix><shard name><suffix>
+configFilePrefix = "LabVIEW_PPL-"
+configFileSuffix = ".gocd.yaml"
+
+
+def splitPipelines(pipelineDict, splitBy):
+    # Returns (shard name, pipelines) pairs, each of which is written as a
+    # separate file with its own copy of the 'common' section
+    if splitBy == "none":
+        return [("Pipelines", pipelineDict)]
+    if splitBy == "repo":
+        shardNames = {
+            name: directoryFromGitRepo(pipeline.gitUrl, None)
+            for name, pipeline in pipelineDict.items()
+        }
+    elif splitBy == "layer":
+        layers = DependencyGraph.fromPipelines(pipelineDict).layers()
+        shardNames = {
+            name: f"Layer_{index:02d}"
+            for index, layer in enumerate(layers)
+            for name in layer
+        }
+    else:
+        raise ValueError("Unknown value for splitBy: " + str(splitBy))
+    shards = {}
+    for name, pipeline in pipelineDict.items():
+        shards.setdefault(shardNames[name], {})[name] = pipeline
+    return sorted(shards.items())
+
+
+def validateCommand(args):
+    # Progress messages go to stderr, leaving only the JSON report on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        pipelineDict = collectPipelineDefinitions(args, stdoutToStderr=True)
+    report = getDependencyReport(pipelineDict, args.job_minutes, args.agents)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    return 0 if report["valid"] else 1
+
+
+def pipelineAliases(pipelineDict):
+    # The names by which 'impact' accepts each pipeline: the pipeline name
+    # ("Actor-Framework.lvlibp"), the PPL name ("Actor Framework.lvlibp") or
+    # the library file name ("Actor Framework.lvlib")
+    aliases = {}
+    for name, p in pipelineDict.items():
+        aliases[os.path.basename(p.libPath)] = name
+        aliases[p.PPL_Name] = name
+        aliases[name] = name
+    return aliases
+
+
+def impactCommand(args):
+    # Uses the index stored by the last run, so nothing is cloned or parsed
+    tic = time.perf_counter()
+    # Any message about an unreadable index goes to stderr, not into the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        index = loadConsumerIndex(args.index)
+    if index is None:
+        print(
+            f"The index at {args.index} is missing or corrupt, run 'generate' first",
+            file=sys.stderr,
+        )
+        return 2
+    aliases = index["aliases"]
+    changed = list(dict.fromkeys(aliases[n] for n in args.names if n in aliases))
+    report = {
+        "changed": changed,
+        "unknown": [n for n in args.names if n not in aliases],
+        # Every pipeline which must be rebuilt, in the order to build them
+        "pipelines": downstream(index, changed),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    print(f"Answered in {time.perf_counter() - tic:0.4f} seconds", file=sys.stderr)
+    return 0 if not report["unknown"] else 1
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(
+        description="Generate the GoCD configuration for the LabVIEW PPL pipelines"
+    )
+    parser.add_argument(
+        "--git-file-list",
+        action="store_true",
+        help="Search for library files using 'git ls-files' instead of scanning the clones",
+    )
+    parser.add_argument(
+        "--metadata-only",
+        action="store_true",
+        help="Read library files from bare mirrors of the repositories, without a checkout",
+    )
+    parser.add_argument(
+        "--clone-workers",
+        type=int,
+        default=8,
+        help="Number of repositories to clone or update concurrently",
+    )
+    parser.add_argument(
+        "--clone-retries",
+        type=int,
+        default=2,
+        help="Number of times to retry a failed clone or update",
+    )
+    parser.add_argument(
+        "--clone-timeout",
+        type=float,
+        default=600,
+        help="Time limit in seconds for each git command",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of processes used to search and parse the repositories",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Parse every repository and metadata file again, without using the caches",
+    )
+    parser.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        help="Discard the cached metadata and fill the cache again from every repository",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=20000,
+        help="Maximum number of parsed files kept in the metadata cache",
+    )
+    parser.add_argument(
+        "--fetch",
+        choices=["transitive", "direct"],
+        default="transitive",
+        help="Fetch the packages of all (transitive) dependencies, or only of the direct"
+        + " dependencies when the package feed provides the rest",
+    )
+    parser.add_argument(
+        "--build-plan",
+        default=None,
+        help="Write the dependency layers which can be built in parallel (the build"
+        + " waves) and the agent profiles needed by each wave to this JSON file",
+    )
+    parser.add_argument(
+        "--rebuild-all-pipeline",
+        action="store_true",
+        help="Also write a '"
+        + rebuildAllPipelineName
+        + "' pipeline, which triggers"
+        + " each build wave in turn",
+    )
+    parser.add_argument(
+        "--no-intern",
+        action="store_true",
+        help="Only create YAML aliases for reused objects, not for repeated content",
+    )
+    parser.add_argument(
+        "--split-by",
+        choices=["none", "repo", "layer"],
+        default="none",
+        help="Write one file per source repository or per dependency layer,"
+        + " instead of a single file",
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="Write the duration of each phase and repository to this file",
+    )
+    parser.add_argument(
+        "--trace-format",
+        choices=sorted(traceWriters),
+        default="chrome",
+        help="'chrome' for chrome://tracing or Perfetto, 'jsonl' for one span per line",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the run, including each repository search in the parsing processes,"
+        + " writing <PROFILE_PREFIX>.cprofile.txt, .pstats and .memory.txt"
+        + " (which only covers the main process)",
+    )
+    parser.add_argument(
+        "--profile-prefix",
+        default="generatorProfile",
+        help="The path and start of the file names of the --profile reports",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=".",
+        help="Directory in which to write the .gocd.yaml file(s)",
+    )
+    parser.set_defaults(function=generateCommand)
+    subparsers = parser.add_subparsers(dest="command")
+
+    generateParser = subparsers.add_parser(
+        "generate", help="Write the .gocd.yaml file (the default command)"
+    )
+    generateParser.set_defaults(function=generateCommand)
+
+    validateParser = subparsers.add_parser(
+        "validate",
+        help="Check the dependency graph for cycles and unknown dependencies,"
+        + " and print a JSON report including the longest dependency chain",
+    )
+    validateParser.add_argument(
+        "--job-minutes",
+        type=float,
+        default=defaultJobMinutes,
+        help="Estimated duration of each build job, used for the build time estimates",
+    )
+    validateParser.add_argument(
+        "--agents",
+        type=int,
+        default=None,
+        help="Number of build agents, for an estimate of the total build time",
+    )
+    validateParser.add_argument(
+        "--output", help="Write the report to this file instead of stdout"
+    )
+    validateParser.set_defaults(function=validateCommand)
+
+    impactParser = subparsers.add_parser(
+        "impact",
+        help="Print (as JSON) the pipelines which must be rebuilt when the given"
+        + " libraries change, using the results stored by the last run",
+    )
+    impactParser.add_argument(
+        "names",
+        nargs="+",
+        help="Library file, PPL or pipeline names, e.g. 'Actor Framework.lvlib'",
+    )
+    impactParser.add_argument(
+        "--index",
+        default=os.path.join("cloned", consumerIndexFileName),
+        help="The consumer index written by 'generate'",
+    )
+    impactParser.add_argument(
+        "--output", help="Write the result to this file instead of stdout"
+    )
+    impactParser.set_defaults(function=impactCommand)
+    return parser.parse_args()
+
+
+def runCommand(args):
+    try:
+        if args.profile:
+            return profileCall(args.profile_prefix, args.function, args)
+        return args.function(args)
+    finally:
+        spans = takeSpans()
+        if args.trace:
+            traceWriters[args.trace_format](args.trace, spans)
+        if args.profile or args.trace:
+            print("Time spent in each span (summed over threads and processes):")
+            for name, total in summarizeSpans(spans).items():
+                print(f"  {total['seconds']:8.2f}s  {total['count']:5d}x  {name}")
+
+
+if __name__ == "__main__":
+    args = parseArguments()
+    sys.exit(runCommand(args))
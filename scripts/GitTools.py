@@ -2,9 +2,12 @@
 import contextlib
 import os
 import shutil
+import signal
 import stat
 import subprocess
-from FileUtils import pushd
+import tempfile
+import time
+from FileUtils import FileIndex
 
 
 def remove_readonly(func, path, excinfo):
@@ -16,44 +19,211 @@ def runCmd(cmd):
     return subprocess.run(cmd, capture_output=True, text=True, shell=False).stdout
 
 
-def cloneRepo(gitUrl, destinationDirectory, forceUpdate=False):
-    # Can add --depth 1 but only marginal improvement at the moment...
-    # gitCmd = f'wsl git clone -q  -- {gitUrl}'
-    gitCmd = ["git", "clone", "-q", "--", gitUrl, destinationDirectory]
-    cloneResult = subprocess.run(gitCmd, capture_output=True, text=True, shell=False)
-    exists = "already exists and is not an empty directory" in cloneResult.stderr
-    if cloneResult.returncode == 128 and exists:
-        if forceUpdate:
-            print(f"Directory already exists. Deleting and re-cloning repository")
-            shutil.rmtree(destinationDirectory, onerror=remove_readonly)
-            return cloneRepo(
-                gitUrl, destinationDirectory, False
-            )  # Don't pass true again, to prevent infinite recursion.
-        else:
-            response = updateRepo(destinationDirectory, True)
-            return (
-                f"Directory already existed at {destinationDirectory}. Updated the repository\n"
-                + response.strip()
-                + "\n"
-            )
-    elif cloneResult.returncode != 0:
-        # Other error, possibly authentication or bad argument
-        raise RuntimeError(
-            f"Error executing command: {gitCmd}\n" + str(cloneResult.stderr)
+def runGitCmd(gitCmd, timeout=None):
+    # The output goes to temporary files rather than pipes, which a child of
+    # git (ssh or git-remote-https) could otherwise keep open after git has
+    # been killed, leaving the read blocked. On timeout the whole process tree
+    # is killed and subprocess.TimeoutExpired is raised.
+    with tempfile.TemporaryFile("w+") as out, tempfile.TemporaryFile("w+") as err:
+        returncode = waitForProcess(gitCmd, timeout, stdout=out, stderr=err)
+        out.seek(0)
+        err.seek(0)
+        if returncode != 0:
+            # Possibly authentication, network or a bad argument
+            raise RuntimeError(f"Error executing command: {gitCmd}\n" + err.read())
+        return out.read()
+
+
+def waitForProcess(cmd, timeout=None, **files):
+    process = subprocess.Popen(cmd, shell=False, start_new_session=True, **files)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        killProcessTree(process)
+        raise
+
+
+def killProcessTree(process):
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+            capture_output=True,
+            shell=False,
         )
     else:
-        # Success
-        return (
-            f"Cloned {gitUrl} to {destinationDirectory}\n"
-            + cloneResult.stdout.strip()
-            + "\n"
-        )
+        # git was started in a new session, so its process group is its own
+        os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+# The branch that the working-tree clones are reset to when updating: the
+# remote's default branch, which is also what a fresh clone checks out and what
+# the HEAD of a mirror (see mirrorRepo) refers to
+remoteBranch = "origin/HEAD"
+
+
+# Outcomes reported by cloneRepo and mirrorRepo
+CLONED = "cloned"
+FAST_FORWARDED = "fast-forwarded"
+UNCHANGED = "unchanged"
+
+
+def generateUpdateSummary(gitUrl, destinationDirectory, outcome, sha, tic):
+    return {
+        "url": gitUrl,
+        "directory": destinationDirectory,
+        "outcome": outcome,
+        "sha": sha,
+        "seconds": round(time.perf_counter() - tic, 3),
+    }
+
+
+def cloneRepo(gitUrl, destinationDirectory, forceUpdate=False, timeout=None):
+    tic = time.perf_counter()
+    if forceUpdate and os.path.exists(destinationDirectory):
+        print(f"Directory already exists. Deleting and re-cloning repository")
+        shutil.rmtree(destinationDirectory, onerror=remove_readonly)
+    if os.path.isdir(os.path.join(destinationDirectory, ".git")):
+        outcome, sha = updateRepo(destinationDirectory, True, timeout)
+    else:
+        # Can add --depth 1 but only marginal improvement at the moment...
+        gitCmd = ["git", "clone", "-q", "--", gitUrl, destinationDirectory]
+        runCloneCmd(gitCmd, destinationDirectory, timeout)
+        outcome, sha = CLONED, getHeadSha(destinationDirectory)
+    return generateUpdateSummary(gitUrl, destinationDirectory, outcome, sha, tic)
+
+
+def runCloneCmd(gitCmd, destinationDirectory, timeout=None):
+    try:
+        runGitCmd(gitCmd, timeout)
+    except (RuntimeError, subprocess.TimeoutExpired):
+        # Don't leave a partial clone to be mistaken for a complete one
+        if os.path.exists(destinationDirectory):
+            shutil.rmtree(destinationDirectory, onerror=remove_readonly)
+        raise
+
+
+def updateRepo(destinationDirectory, useRemote=True, timeout=None):
+    # Uses '-C' rather than changing the working directory, which is shared
+    # by every thread in the process
+    gitCmd = ["git", "-C", destinationDirectory]
+    if useRemote:
+        runGitCmd(gitCmd + ["fetch", "-q", "origin"], timeout)
+    localSha = getHeadSha(destinationDirectory)
+    remoteSha = getRemoteHeadSha(destinationDirectory, timeout)
+    if localSha == remoteSha:
+        return UNCHANGED, localSha
+    runGitCmd(gitCmd + ["reset", "-q", "--hard", remoteSha], timeout)
+    runGitCmd(gitCmd + ["clean", "-f", "-q"], timeout)
+    return FAST_FORWARDED, remoteSha
+
+
+def getRemoteHeadSha(repoDirectory, timeout=None):
+    gitCmd = ["git", "-C", repoDirectory]
+    revParseCmd = gitCmd + ["rev-parse", "--verify", "-q", remoteBranch]
+    try:
+        return runGitCmd(revParseCmd).strip()
+    except RuntimeError:
+        # origin/HEAD is only missing from clones where it was never recorded,
+        # so ask the remote for its default branch once
+        runGitCmd(gitCmd + ["remote", "set-head", "origin", "-a"], timeout)
+        return runGitCmd(revParseCmd).strip()
+
+
+def getHeadSha(repoDirectory):
+    return runCmd(["git", "-C", repoDirectory, "rev-parse", "HEAD"]).strip()
+
+
+def listTrackedFiles(repoDirectory):
+    output = runCmd(["git", "-C", repoDirectory, "ls-files", "-z"])
+    return [path for path in output.split("\0") if path]
+
+
+def mirrorRepo(gitUrl, destinationDirectory, timeout=None):
+    # A mirror has no working tree, and with a partial clone (where the server
+    # supports it) blobs are only downloaded when they are read
+    tic = time.perf_counter()
+    if os.path.isdir(destinationDirectory):
+        previousSha = getHeadSha(destinationDirectory)
+        gitCmd = ["git", "-C", destinationDirectory, "fetch", "-q", "--prune"]
+        runGitCmd(gitCmd, timeout)
+        sha = getHeadSha(destinationDirectory)
+        outcome = UNCHANGED if sha == previousSha else FAST_FORWARDED
+    else:
+        gitCmd = ["git", "clone", "-q", "--mirror", "--filter=blob:none"]
+        gitCmd += ["--", gitUrl, destinationDirectory]
+        runCloneCmd(gitCmd, destinationDirectory, timeout)
+        outcome, sha = CLONED, getHeadSha(destinationDirectory)
+    return generateUpdateSummary(gitUrl, destinationDirectory, outcome, sha, tic)
+
+
+def readBlobs(repoDirectory, blobShas, timeout=None):
+    # Reads any number of objects with a single 'git cat-file --batch' process.
+    # In a partial clone, missing blobs are fetched from the remote, so this
+    # is limited by the same timeout as the other git commands (see runGitCmd).
+    gitCmd = ["git", "-C", repoDirectory, "cat-file", "--batch"]
+    request = "".join(sha + "\n" for sha in blobShas).encode()
+    requestFile = tempfile.TemporaryFile()
+    with requestFile, tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        requestFile.write(request)
+        requestFile.seek(0)
+        try:
+            returncode = waitForProcess(
+                gitCmd, timeout, stdin=requestFile, stdout=out, stderr=err
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(
+                f"Timed out after {timeout} seconds reading objects from {repoDirectory}"
+            )
+        if returncode != 0:
+            err.seek(0)
+            raise RuntimeError(
+                f"Error executing command: {gitCmd}\n" + err.read().decode()
+            )
+        out.seek(0)
+        output = out.read()
+    blobs = {}
+    position = 0
+    for sha in blobShas:
+        headerEnd = output.index(b"\n", position)
+        header = output[position:headerEnd].decode().split(" ")
+        if header[-1] == "missing":
+            raise RuntimeError(f"Object {sha} is missing from {repoDirectory}")
+        size = int(header[2])
+        blobs[sha] = output[headerEnd + 1 : headerEnd + 1 + size]
+        position = headerEnd + 1 + size + 1
+    return blobs
+
+
+class GitTreeIndex(FileIndex):
+    # A FileIndex over the files of a commit in a (possibly bare) repository,
+    # reading the content from the object store rather than a working tree
+    def __init__(self, repoDirectory, treeish="HEAD", timeout=None):
+        self.timeout = timeout
+        output = runCmd(["git", "-C", repoDirectory, "ls-tree", "-r", "-z", treeish])
+        self.blobShas = {}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            mode, objectType, sha = info.split(" ")
+            if objectType == "blob":
+                self.blobShas[path] = sha
+        super().__init__(repoDirectory, self.blobShas.keys())
 
+    def blobSha(self, relPath):
+        return self.blobShas[relPath.replace(os.sep, "/")]
 
-def updateRepo(destinationDirectory, useRemote=True):
-    with pushd(destinationDirectory):
-        if useRemote:
-            runCmd(["git", "fetch"])
-        response = runCmd(["git", "reset", "--hard", "origin/master"])
-        runCmd(["git", "clean", "-f"])
-        return response.strip()
+    def readFiles(self, relPaths):
+        if not relPaths:
+            return {}
+        blobShas = [self.blobSha(p) for p in relPaths]
+        blobs = readBlobs(self.top_directory, blobShas, self.timeout)
+        contents = {}
+        for relPath in relPaths:
+            blob = blobs[self.blobSha(relPath)]
+            self.bytesRead += len(blob)
+            text = blob.decode()
+            # Match the universal newline handling of open(path, "r")
+            contents[relPath] = text.replace("\r\n", "\n").replace("\r", "\n")
+        return contents
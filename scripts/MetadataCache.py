@@ -0,0 +1,87 @@
+import json
+import os
+import sqlite3
+import time
+
+# Increment when a parser's output changes, so that older results are not used
+cacheFormatVersion = 1
+
+
+class MetadataCache:
+    # Parsed metadata files, keyed by the kind of file and the git blob SHA of
+    # its content, so that the same content is never parsed twice - across
+    # runs, or across repositories which contain copies of the same file
+    def __init__(self, cachePath, maxEntries=20000):
+        os.makedirs(os.path.dirname(os.path.abspath(cachePath)), exist_ok=True)
+        self.maxEntries = maxEntries
+        # Several parsing processes can share the file
+        self.connection = sqlite3.connect(cachePath, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS parsed ("
+            " kind TEXT NOT NULL,"
+            " blob_sha TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (kind, blob_sha))"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _key(kind):
+        return f"{kind}:{cacheFormatVersion}"
+
+    def getMany(self, kind, blobShas):
+        # Returns the cached results for those SHAs which are present
+        found = {}
+        now = time.time()
+        with self.connection:
+            for blobSha in set(blobShas):
+                row = self.connection.execute(
+                    "SELECT result FROM parsed WHERE kind = ? AND blob_sha = ?",
+                    (self._key(kind), blobSha),
+                ).fetchone()
+                if row is not None:
+                    found[blobSha] = json.loads(row[0])
+                    self.connection.execute(
+                        "UPDATE parsed SET last_used = ? WHERE kind = ? AND blob_sha = ?",
+                        (now, self._key(kind), blobSha),
+                    )
+        return found
+
+    def putMany(self, kind, results):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?)",
+                [
+                    (self._key(kind), blobSha, json.dumps(result), now)
+                    for blobSha, result in results.items()
+                ],
+            )
+
+    def evict(self):
+        # Removes the least recently used entries beyond maxEntries
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM parsed WHERE rowid IN ("
+                " SELECT rowid FROM parsed ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.maxEntries,),
+            )
+        return cursor.rowcount
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM parsed")
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM parsed").fetchone()[0]
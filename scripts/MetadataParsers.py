@@ -0,0 +1,91 @@
+import re
+
+# Each pattern is compiled once, and each file is read in a single pass
+
+# <Library+Name>_REPO := <url>
+repoListMatcher = re.compile(r"^(.*?)_REPO\s?:=\s?(.*)$")
+
+# <Library+Name>_Deps := <dependency> <dependency\ with\ spaces>
+mkDepsMatcher = re.compile(r"^(.+?)_Deps[ ]?:=[ ]?(.*)$")
+
+# <Variable> := <value> <value>, in a <Library Name>.build_config file
+buildConfigMatcher = re.compile(r"^(\w+)\s?:=\s?(.*)$")
+
+
+def parseDependencyList(depString: str) -> list:
+    # Split the group on unescaped spaces
+    listDeps = depString.replace(r"\ ", "+").split(" ")
+    depsList = [elem.replace("+", " ") for elem in listDeps]
+    return depsList
+
+
+def parseRepoList(content):
+    # Returns a list of (library name, repository url) pairs
+    repos = []
+    for line in content.splitlines():
+        if line.startswith("#"):
+            continue
+        match = repoListMatcher.match(line.strip())
+        if match:
+            repos.append((match.group(1), match.group(2)))
+    return repos
+
+
+def parseMkVariables(content):
+    # Returns the dependency lists of every library declared in the file,
+    # keyed by the library name (with spaces, without '.lvlib')
+    variables = {}
+    for line in content.splitlines():
+        match = mkDepsMatcher.match(line.strip())
+        if match:
+            libraryName = match.group(1).replace("+", " ")
+            if libraryName not in variables:
+                variables[libraryName] = parseDependencyList(match.group(2))
+    return variables
+
+
+def getMkDependencies(mkVariables, buildObjectName, mkFilePath):
+    deps = mkVariables.get(buildObjectName.replace(".lvlib", ""))
+    if deps is None:
+        print(
+            f"Warning: Found a .mk file ({mkFilePath}) but could not parse it to get dependencies"
+        )
+    return deps
+
+
+def parseVipkgReqsContent(content):
+    vipkgUrls = []
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#") or line == "":
+            continue
+        vipkgUrls.append(line)
+    return vipkgUrls if len(vipkgUrls) > 0 else None
+
+
+def parseBuildConfigContent(content):
+    # Returns the list of values of each variable, e.g.
+    # {"Targets": ["Windows_32_Release", "cRIO_Release"], "LabVIEW_Versions": ["2021"]}
+    variables = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            continue
+        match = buildConfigMatcher.match(line)
+        if match:
+            variables[match.group(1)] = match.group(2).split()
+    return variables
+
+
+def parseMetadataContent(kind, content):
+    # kind is the extension of a library's metadata file
+    if kind == "mk":
+        return parseMkVariables(content)
+    if kind == "vipm_reqs":
+        return parseVipkgReqsContent(content)
+    if kind == "build_config":
+        return parseBuildConfigContent(content)
+    if kind == "min_lv_version":
+        # Validated by the caller
+        return content
+    raise ValueError("Unknown kind of metadata file: " + str(kind))
@@ -29,14 +29,16 @@ def generateMaterials(gitUrl, dependencies, cachedMaterials):
     return materials
 
 
-def generateFetchPPLJob(dependency, targetName):
+def generateFetchPPLJob(dependency, targetName, pipelinePath=None):
+    # pipelinePath is needed when the dependency is not a direct upstream
+    # pipeline, e.g. "grandparent/parent"
     dependencyRootName = getPackageRootName(dependency)
     packageId = f"{dependencyRootName}_{targetName}_nipkg"
     return {
         "fetch": {
             "run_if": "passed",
             "artifact_origin": "external",
-            "pipeline": dependency,
+            "pipeline": pipelinePath or dependency,
             "stage": "build_ppls",
             "job": targetName,
             "artifact_id": packageId,
@@ -0,0 +1,74 @@
+import json
+import os
+
+# Increment when the content of the stored entries changes, so that old state
+# files are ignored rather than served as if they were current.
+stateFormatVersion = 2
+
+
+def loadRepoState(statePath):
+    if not os.path.exists(statePath):
+        return {}
+    with open(statePath, "r") as f:
+        try:
+            content = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Ignoring unreadable repository state file: {statePath}")
+            return {}
+    if content.get("version") != stateFormatVersion:
+        return {}
+    return content.get("repositories", {})
+
+
+def saveRepoState(statePath, repositories):
+    os.makedirs(os.path.dirname(os.path.abspath(statePath)), exist_ok=True)
+    content = {"version": stateFormatVersion, "repositories": repositories}
+    writeJson(statePath, content, indent=1, sort_keys=True)
+
+
+def writeJson(path, content, **dumpArguments):
+    # Write then rename, so an interrupted run cannot leave a truncated file
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(content, f, **dumpArguments)
+    os.replace(tmpPath, path)
+
+
+def isStateCurrent(cachedState, headSha, libNames):
+    return (
+        cachedState is not None
+        and cachedState.get("sha") == headSha
+        and cachedState.get("libNames") == libNames
+    )
+
+
+# The consumers of each pipeline, stored next to the repository state so that
+# 'impact' can answer without reading the state or building the graph
+consumerIndexFormatVersion = 1
+
+
+def loadConsumerIndex(indexPath):
+    if not os.path.exists(indexPath):
+        return None
+    with open(indexPath, "r") as f:
+        try:
+            content = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Ignoring unreadable consumer index file: {indexPath}")
+            return None
+    if not isinstance(content, dict):
+        return None
+    if content.get("version") != consumerIndexFormatVersion:
+        return None
+    return content
+
+
+def saveConsumerIndex(indexPath, aliases, consumerIndex):
+    os.makedirs(os.path.dirname(os.path.abspath(indexPath)), exist_ok=True)
+    content = {
+        "version": consumerIndexFormatVersion,
+        "aliases": aliases,
+        **consumerIndex,
+    }
+    # Not indented, since it is only read by the generator
+    writeJson(indexPath, content)
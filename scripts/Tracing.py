@@ -0,0 +1,168 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Timing spans recorded in this process. Worker processes return theirs with
+# each result (see takeSpans), to be added to the parent's with addSpans.
+_spans = []
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    # The yielded dictionary can be used to add attributes during the span
+    start = time.time()
+    tic = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        _spans.append(
+            {
+                "name": name,
+                # Wall-clock time, which is comparable between processes
+                "start": start,
+                "seconds": time.perf_counter() - tic,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                **attributes,
+            }
+        )
+
+
+def takeSpans():
+    # Returns and forgets the spans recorded so far
+    spans = _spans[:]
+    del _spans[: len(spans)]
+    return spans
+
+
+def resetSpans():
+    # For new worker processes, which may have been forked with a copy of
+    # the parent's spans
+    del _spans[:]
+
+
+def addSpans(spans):
+    _spans.extend(spans)
+
+
+def summarizeSpans(spans):
+    # The count and total duration of each kind of span, slowest first
+    totals = {}
+    for s in spans:
+        total = totals.setdefault(s["name"], {"count": 0, "seconds": 0.0})
+        total["count"] += 1
+        total["seconds"] += s["seconds"]
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
+
+
+def writeJsonLines(path, spans):
+    with open(path, "w") as f:
+        for s in spans:
+            f.write(json.dumps(s) + "\n")
+
+
+def writeChromeTrace(path, spans):
+    # The Trace Event Format read by chrome://tracing and https://ui.perfetto.dev
+    events = []
+    for s in sorted(spans, key=lambda s: s["start"]):
+        args = {
+            k: v
+            for k, v in s.items()
+            if k not in ["name", "start", "seconds", "pid", "tid"]
+        }
+        events.append(
+            {
+                "name": s["name"],
+                "ph": "X",
+                "ts": round(s["start"] * 1e6),
+                "dur": round(s["seconds"] * 1e6),
+                "pid": s["pid"],
+                "tid": s["tid"],
+                "args": args,
+            }
+        )
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+traceWriters = {"jsonl": writeJsonLines, "chrome": writeChromeTrace}
+
+
+# Raw cProfile statistics of the calls profiled in worker processes (see
+# profileWorkerCall), which profileCall merges into its report
+_profileStats = []
+_profileWorkerCalls = False
+
+
+def enableWorkerProfiling(enabled=True):
+    # For new worker processes, whose calls are otherwise not profiled
+    global _profileWorkerCalls
+    _profileWorkerCalls = enabled
+
+
+def profileWorkerCall(function, *args):
+    # Returns the result and, if profiling is enabled in this process, the raw
+    # statistics, which (unlike a cProfile.Profile) can be sent to the parent
+    if not _profileWorkerCalls:
+        return function(*args), None
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+    profiler.create_stats()
+    return result, profiler.stats
+
+
+def addProfileStats(stats):
+    if stats:
+        _profileStats.append(stats)
+
+
+def takeProfileStats():
+    stats = _profileStats[:]
+    del _profileStats[: len(stats)]
+    return stats
+
+
+class _RawProfileStats:
+    # What pstats.Stats.add needs of a profiler
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profileCall(reportPrefix, function, *args):
+    # Runs function under cProfile and tracemalloc, then writes the hot spots
+    # sorted by cumulative and own time, and the largest allocations. The
+    # statistics added by addProfileStats are included in the hot spots, but
+    # the memory report only covers this process.
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = pstats.Stats(profiler)
+        workerCalls = len(_profileStats)
+        for workerStats in takeProfileStats():
+            stats.add(_RawProfileStats(workerStats))
+        stats.dump_stats(reportPrefix + ".pstats")
+        with open(reportPrefix + ".cprofile.txt", "w") as f:
+            f.write(f"Including {workerCalls} calls profiled in worker processes\n")
+            stats.stream = f
+            stats.strip_dirs()
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(50)
+        with open(reportPrefix + ".memory.txt", "w") as f:
+            f.write(f"Peak traced memory: {peak / 2**20:0.1f} MiB\n")
+            f.write("Memory still allocated at the end, by line:\n")
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+        print(f"Wrote profiling reports to {reportPrefix}.*")
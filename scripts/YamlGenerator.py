@@ -15,7 +15,10 @@ from Constants import (
     profileId,
     Target,
     targetPathEnds,
+    allowedVersionStrings,
+    defaultLabVIEWVersion,
 )
+from DependencyGraph import DependencyGraph
 from PipelineGenerationUtils import (
     generateMaterials,
     generateFetchPPLJob,
@@ -57,44 +60,76 @@ ppl_build_artifact = {
 nipkg_build_artifact = {"build": {"source": "NIPKGs/*", "destination": "#{PPL_Name}"}}
 
 
+# Task lists and tasks are built once and then reused by every pipeline and
+# target that needs the same content, so they are written as aliases and the
+# generator's allocation does not grow with libraries x targets x dependencies
+pplJobTaskLists = {}
+fetchPPLTasks = {}
+vipkgTasks = {}
+
+
+def getFetchPPLTask(pipelinePath, targetName):
+    # The package is built by the first pipeline in the path
+    key = (pipelinePath, targetName)
+    if key not in fetchPPLTasks:
+        fetchPPLTasks[key] = generateFetchPPLJob(
+            pipelinePath.split("/")[0], targetName, pipelinePath
+        )
+    return fetchPPLTasks[key]
+
+
+def getVipkgTask(vipkgUrl, labviewDirectory):
+    key = (vipkgUrl, labviewDirectory)
+    if key not in vipkgTasks:
+        vipkgTasks[key] = {
+            "plugin": {
+                "run_if": "passed",
+                "options": {
+                    "Url": vipkgUrl,
+                    "LabVIEWDirectory": labviewDirectory,
+                    "Verbose": False,
+                },
+                "configuration": {
+                    "id": "jp.oist.chakraborty.vi-package-installer",
+                    "version": "0.1",
+                },
+            }
+        }
+    return vipkgTasks[key]
+
+
 def generatePPLJobTasksWithDeps(dependencies, vipkgUrls, targetName, lv_version):
     if dependencies is None and vipkgUrls is None:
         raise ValueError(
             "Attempted to generate a PPL Task List with dependencies without passing a list of Dependencies"
         )
+    labviewDirectory = labviewDir[lv_version][Target[targetName]]
+    key = (
+        None if dependencies is None else tuple(dependencies),
+        None if vipkgUrls is None else tuple(vipkgUrls),
+        targetName,
+        labviewDirectory,
+    )
+    if key in pplJobTaskLists:
+        return pplJobTaskLists[key]
     pplDepTasks = []
     if dependencies is not None:
         pplDepTasks.append(create_ppl_dir)
         for dependency in dependencies:
-            pplDepTasks.append(generateFetchPPLJob(dependency, targetName))
+            pplDepTasks.append(getFetchPPLTask(dependency, targetName))
         pplDepTasks.append(mklink_tasks[targetName])
         pplDepTasks.append(ls_currentDir_task)
-    vipkgTasks = []
+    vipkgInstallTasks = []
     if vipkgUrls is not None:
-        targetT = Target[targetName]
         for vipkgUrl in vipkgUrls:
-            vipkgTasks.append(
-                {
-                    "plugin": {
-                        "run_if": "passed",
-                        "options": {
-                            "Url": vipkgUrl,
-                            "LabVIEWDirectory": labviewDir[lv_version][targetT],
-                            "Verbose": False,
-                        },
-                        "configuration": {
-                            "id": "jp.oist.chakraborty.vi-package-installer",
-                            "version": "0.1",
-                        },
-                    }
-                }
-            )
-    return (
+            vipkgInstallTasks.append(getVipkgTask(vipkgUrl, labviewDirectory))
+    pplJobTaskLists[key] = (
         [fetch_builder_task, expand_builder_task]
         + pplDepTasks
-        + vipkgTasks
+        + vipkgInstallTasks
         + [ls_task, gcli_build_task]
     )
+    return pplJobTaskLists[key]
 
 
 nipkgConfigOptions = {"options": {"PackagePath": "NIPKGs/*.nipkg"}}
@@ -113,28 +148,46 @@ for target in Target.__members__:
     }
 
 
-def generatePPLJobList(packageRootName, lv_version, dependencies, vipkgUrls):
+# The job fields which depend only on the LabVIEW version and the target
+targetJobFields = {
+    lv_version: {
+        target: {
+            "elastic_profile_id": profileId[lv_version][Target[target]],
+            "environment_variables": environmentVariables[Target[target]],
+        }
+        for target in Target.__members__
+    }
+    for lv_version in allowedVersionStrings
+}
+
+# The artifacts built by every PPL job, before the per-target external artifact
+sharedPPLArtifacts = [ppl_build_artifact, nipkg_build_artifact]
+
+
+def generateExternalArtifact(packageRootName, targetName):
+    return {
+        "external": {
+            # This id-value changes per PPL and target, and parameters cannot be used here
+            "id": f"{packageRootName}_{targetName}_nipkg",
+            "store_id": "cicwin",
+            "configuration": nipkgConfigOptions,
+        }
+    }
+
+
+def generatePPLJobList(
+    packageRootName, lv_version, dependencies, vipkgUrls, targets=Target._member_names_
+):
+    # One job per target. Only the target's fields, the artifact id and the
+    # tasks (which are also shared, see generatePPLJobTasksWithDeps) vary
+    # between the jobs.
     ppl_job_list = {}
-    for target in Target.__members__:
-        targetT = Target[target]
-        packageId = f"{packageRootName}_{target}_nipkg"
+    for target in targets:
         ppl_job_list[target] = {
             "timeout": 15,
-            "elastic_profile_id": profileId[lv_version][targetT],
-            "environment_variables": environmentVariables[targetT],
-            "artifacts": [
-                ppl_build_artifact,
-                nipkg_build_artifact,
-                {
-                    "external": {
-                        # This id-value changes per PPL, but could be made into a set of 6 aliases (one per target)
-                        # Actually, this might not allow parameter usage...
-                        "id": packageId,
-                        "store_id": "cicwin",
-                        "configuration": nipkgConfigOptions,
-                    }
-                },
-            ],
+            **targetJobFields[lv_version][target],
+            "artifacts": sharedPPLArtifacts
+            + [generateExternalArtifact(packageRootName, target)],
             "tasks": (
                 PPLJobTasks_NoDeps
                 if dependencies is None and vipkgUrls is None
@@ -146,7 +199,9 @@ def generatePPLJobList(packageRootName, lv_version, dependencies, vipkgUrls):
     return ppl_job_list
 
 
-def generatePPLStage(packageRootName, lv_version, dependencies, vipkgUrls):
+def generatePPLStage(
+    packageRootName, lv_version, dependencies, vipkgUrls, targets=Target._member_names_
+):
     return {
         "build_ppls": {
             "fetch_materials": "yes",
@@ -154,7 +209,7 @@ def generatePPLStage(packageRootName, lv_version, dependencies, vipkgUrls):
             "approval": "manual",  # Set to "manual" to prevent auto-scheduling, "success" to allow autotriggering
             # Git material is set not to autoupdate, so this controls if pipelines are triggered by PPL dependencies
             "jobs": generatePPLJobList(
-                packageRootName, lv_version, dependencies, vipkgUrls
+                packageRootName, lv_version, dependencies, vipkgUrls, targets
             ),
         }
     }
@@ -173,37 +228,58 @@ def get_fetch_built_ppl_task(target):
     }
 
 
-git_tag_tasks = [fetch_builder_task, expand_builder_task]
-for target in Target._member_names_:
-    git_tag_tasks.append(get_fetch_built_ppl_task(target))
-git_tag_tasks.append(
-    {"exec": {"run_if": "passed", "command": "dir", "arguments": ["*"]}}
-)
-git_tag_tasks.append(
-    {
-        "exec": {
-            "run_if": "passed",
-            "command": "py",
-            "arguments": ["-3", "-u", "PPL_Builder/publish_github.py"],
-        }
-    }
-)
+fetch_built_ppl_tasks = {
+    target: get_fetch_built_ppl_task(target) for target in Target._member_names_
+}
 
-git_tag_stage = {
-    "git_tag": {
-        "approval": "success",
-        "fetch_materials": "yes",
-        "environment_variables": {
-            "GITHUB_RELEASE_TOKEN": "{{SECRET:[secrets.json][github_publishing_token]}}",
-            "PPL_NAME": "#{PPL_Name}",
-            "RELEASE_NOTES": "",
-        },
-        "resources": ["powershell"],
-        # Single job, so no need for jobs entry
-        "tasks": git_tag_tasks,
+list_artifacts_task = {
+    "exec": {"run_if": "passed", "command": "dir", "arguments": ["*"]}
+}
+
+publish_github_task = {
+    "exec": {
+        "run_if": "passed",
+        "command": "py",
+        "arguments": ["-3", "-u", "PPL_Builder/publish_github.py"],
     }
 }
 
+git_tag_environment_variables = {
+    "GITHUB_RELEASE_TOKEN": "{{SECRET:[secrets.json][github_publishing_token]}}",
+    "PPL_NAME": "#{PPL_Name}",
+    "RELEASE_NOTES": "",
+}
+
+
+def generateGitTagStage(targets):
+    # The release fetches the PPLs built by each of the pipeline's jobs
+    git_tag_tasks = [fetch_builder_task, expand_builder_task]
+    for target in targets:
+        git_tag_tasks.append(fetch_built_ppl_tasks[target])
+    git_tag_tasks.append(list_artifacts_task)
+    git_tag_tasks.append(publish_github_task)
+    return {
+        "git_tag": {
+            "approval": "success",
+            "fetch_materials": "yes",
+            "environment_variables": git_tag_environment_variables,
+            "resources": ["powershell"],
+            # Single job, so no need for jobs entry
+            "tasks": git_tag_tasks,
+        }
+    }
+
+
+# One stage for each set of targets, shared by the pipelines which build them
+gitTagStages = {}
+
+
+def getGitTagStage(targets):
+    key = tuple(targets)
+    if key not in gitTagStages:
+        gitTagStages[key] = generateGitTagStage(targets)
+    return gitTagStages[key]
+
 
 # Defines all of the 'common' parts of the pipeline config file
 def getCommonSection():
@@ -234,6 +310,11 @@ class PipelineDefinition(yaml.YAMLObject):
         self.dependencyPPLNames = values["Dependency PPL Names"]
         self.minVersion = values.get("minLabVIEWVersion")
         self.vipkgUrls = values.get("vipkgUrls")
+        # Restricted by a <library>.build_config file, otherwise everything
+        self.targets = values.get("targets") or Target._member_names_
+        self.labVIEWVersions = values.get("labVIEWVersions") or allowedVersionStrings
+        # The pipeline paths of the packages to fetch, see updateFetchDependencies
+        self.fetchDependencies = None
 
     def buildData(self, dumper):
         materials = {"builder": builderMaterial} | generateMaterials(
@@ -247,7 +328,7 @@ class PipelineDefinition(yaml.YAMLObject):
         if self.minVersion != None:
             lv_version = self.minVersion
         else:
-            lv_version = "2019"
+            lv_version = defaultLabVIEWVersion
         return {
             "group": "PPLs",
             "parameters": {
@@ -262,10 +343,11 @@ class PipelineDefinition(yaml.YAMLObject):
                 generatePPLStage(
                     getPackageRootName(self.name),
                     lv_version,
-                    self.dependencies,
+                    self.fetchDependencies or self.dependencies,
                     self.vipkgUrls,
+                    self.targets,
                 ),
-                git_tag_stage,
+                getGitTagStage(self.targets),
             ],
         }
 
@@ -275,6 +357,76 @@ class PipelineDefinition(yaml.YAMLObject):
         return dumper.represent_mapping("tag:yaml.org,2002:map", data)
 
 
+# libyaml's emitter is much faster than the pure-Python one, when available
+try:
+    from yaml import CSafeDumper as BaseConfigDumper
+except ImportError:
+    from yaml import SafeDumper as BaseConfigDumper
+
+
+def representPipelineDefinition(dumper, pipeline):
+    return dumper.represent_mapping("tag:yaml.org,2002:map", pipeline.buildData(dumper))
+
+
+def createConfigDumper(baseDumper):
+    class ConfigDumper(baseDumper):
+        pass
+
+    ConfigDumper.add_representer(PipelineDefinition, representPipelineDefinition)
+    return ConfigDumper
+
+
+ConfigDumper = createConfigDumper(BaseConfigDumper)
+
+
+def dumpYamlObject(yamlObject, stream=None, Dumper=ConfigDumper):
+    # Aliases are created (as for yaml.Dumper) wherever the same object is reused
+    return yaml.dump(
+        yamlObject,
+        stream,
+        Dumper=Dumper,
+        sort_keys=False,
+        width=999999,
+        line_break="\r\n",
+    )
+
+
+def internYamlObject(yamlObject):
+    # Aliases are only created where the same object is reused (see README), so
+    # equal content built by separate calls is otherwise written out in full.
+    # This returns a copy in which all equal (non-empty) dicts and lists are the
+    # same object, so every repeated fragment is written once, as an anchor.
+    canonical = {}
+    interned = {}
+
+    def contentKey(value):
+        # Children are interned first, so containers can be compared by id
+        if isinstance(value, (dict, list)):
+            return ("object", id(value))
+        return (type(value).__name__, value)
+
+    def intern(value):
+        if isinstance(value, PipelineDefinition):
+            value = value.buildData(None)
+        if not isinstance(value, (dict, list)):
+            return value
+        if id(value) in interned:
+            return interned[id(value)][1]
+        if isinstance(value, dict):
+            result = {k: intern(v) for k, v in value.items()}
+            key = ("dict",) + tuple((k, contentKey(v)) for k, v in result.items())
+        else:
+            result = [intern(v) for v in value]
+            key = ("list",) + tuple(contentKey(v) for v in result)
+        if len(result) > 0:
+            result = canonical.setdefault(key, result)
+        # Keep the original alive, so that its id cannot be reused
+        interned[id(value)] = (value, result)
+        return result
+
+    return intern(yamlObject)
+
+
 def buildYamlObject(pipelineDictionary):
     full_yaml_object = {
         "format_version": 10,
@@ -284,48 +436,149 @@ def buildYamlObject(pipelineDictionary):
     return full_yaml_object
 
 
-def findNonDefaultLVPipelines(pipelineDictionary, defaultVersion):
-    def myfilter(item):
-        return item[1].minVersion != None and item[1].minVersion != defaultVersion
-
-    return dict(filter(myfilter, pipelineDictionary.items())).keys()
-
-
 def updateMinimumVersions(pipelineDictionary):
-    # This code only works for 2 versions. With multiple non-default versions, needs more care
-    nonDefaultPipelineNames = findNonDefaultLVPipelines(pipelineDictionary, "2019")
-    if len(nonDefaultPipelineNames) == 0:
+    # Each pipeline must be built with at least the highest version required by
+    # any of its (transitive) dependencies
+    graph = DependencyGraph.fromPipelines(pipelineDictionary)
+    requiredVersions = graph.propagateMaximum(
+        {
+            name: pipeline.minVersion or defaultLabVIEWVersion
+            for name, pipeline in pipelineDictionary.items()
+        },
+        allowedVersionStrings.index,
+    )
+    pipelinesToUpdate = {
+        name
+        for name, version in requiredVersions.items()
+        if version != defaultLabVIEWVersion
+    }
+    if len(pipelinesToUpdate) == 0:
         return pipelineDictionary
-    pipelinesToUpdate = set(nonDefaultPipelineNames)
-    newElements = []
-
-    def dependsOnElems(dependenciesToInclude):
-        def innerFilter(item):
-            itemDependencies = item[1].dependencies
-            if itemDependencies == None:
-                return False
-            return (
-                set(itemDependencies) & set(dependenciesToInclude)
-                and item[0] not in dependenciesToInclude
-            )
-
-        return innerFilter
-
-    while True:
-        newElements = dict(
-            filter(dependsOnElems(pipelinesToUpdate), pipelineDictionary.items())
-        ).keys()
-        pipelinesToUpdate.update(newElements)
-        if len(newElements) == 0:
-            break
     print("Updating target LabVIEW versions for " + str(pipelinesToUpdate))
+    for name in pipelinesToUpdate:
+        pipelineDictionary[name].minVersion = requiredVersions[name]
+    return pipelineDictionary
+
+
+def updateFetchDependencies(pipelineDictionary, transitive=True):
+    # Each pipeline fetches the packages of its direct dependencies (once each),
+    # or with transitive, also those of their dependencies, so that none are
+    # left to be resolved when they are installed. Packages are fetched in the
+    # order in which they are built.
+    graph = DependencyGraph.fromPipelines(pipelineDictionary)
+    if not transitive:
+        for name, pipeline in pipelineDictionary.items():
+            pipeline.fetchDependencies = graph.dependencies[name] or None
+        return pipelineDictionary
+    order, _ = graph.topologicalOrder()
+    position = {name: index for index, name in enumerate(order)}
+    ancestorPaths = graph.ancestorPaths()
+    for name, pipeline in pipelineDictionary.items():
+        paths = ancestorPaths[name]
+        pipeline.fetchDependencies = [
+            paths[ancestor] for ancestor in sorted(paths, key=position.__getitem__)
+        ] or None
+    return pipelineDictionary
+
+
+def generateBuildPlan(pipelineDictionary):
+    # The dependency layers as build waves: every pipeline in a wave can be
+    # built concurrently once the earlier waves have been built. The demand
+    # counts the build jobs of the wave which need each elastic agent profile.
+    layers = DependencyGraph.fromPipelines(pipelineDictionary).layers()
+    waves = []
+    peakDemand = {}
+    for index, layer in enumerate(layers):
+        demand = {}
+        for name in layer:
+            pipeline = pipelineDictionary[name]
+            lv_version = pipeline.minVersion or defaultLabVIEWVersion
+            for target in pipeline.targets:
+                profile = targetJobFields[lv_version][target]["elastic_profile_id"]
+                demand[profile] = demand.get(profile, 0) + 1
+        demand = dict(sorted(demand.items()))
+        for profile, jobs in demand.items():
+            peakDemand[profile] = max(peakDemand.get(profile, 0), jobs)
+        waves.append(
+            {
+                "wave": index,
+                "pipelines": sorted(layer),
+                "jobs": sum(demand.values()),
+                "agentProfiles": demand,
+            }
+        )
+    return {
+        "pipelines": len(pipelineDictionary),
+        "jobs": sum(wave["jobs"] for wave in waves),
+        "peakAgentProfiles": dict(sorted(peakDemand.items())),
+        "waves": waves,
+    }
 
-    def updateVers(name, pipeline):
-        if name in pipelinesToUpdate:
-            pipeline.minVersion = "2021"
-        return pipeline
 
-    # Seems like the comprehension here forces the function to iterate over the items
-    # Calling the function without creating the dictionary leaves it unexecuted
-    newDict = {k: updateVers(k, v) for k, v in pipelineDictionary.items()}
-    return newDict
+rebuildAllPipelineName = "Rebuild_All_PPLs"
+
+# Schedules every pipeline named in TRIGGER_PIPELINES through the GoCD API,
+# then waits until each one's build_ppls stage has finished. Only single quotes
+# are used, since the arguments are passed on to powershell unescaped.
+trigger_wave_script = "; ".join(
+    [
+        "$ErrorActionPreference = 'Stop'",
+        "$api = $env:GO_SERVER_URL.TrimEnd('/') + '/api/pipelines/'",
+        "$auth = 'bearer ' + $env:GOCD_API_TOKEN",
+        "function Get-LastRun($p) { (Invoke-RestMethod -Uri ($api + $p + '/history?page_size=1')"
+        + " -Headers @{ Authorization = $auth; Accept = 'application/vnd.go.cd+json' }).pipelines[0] }",
+        "$names = $env:TRIGGER_PIPELINES -split ' '",
+        "$before = @{}",
+        "foreach ($p in $names) { $before[$p] = (Get-LastRun $p).counter }",
+        "foreach ($p in $names) { Invoke-RestMethod -Method Post -Uri ($api + $p + '/schedule')"
+        + " -Headers @{ Authorization = $auth; Accept = 'application/vnd.go.cd.v1+json'; 'X-GoCD-Confirm' = 'true' } | Out-Null }",
+        "$failed = @()",
+        "foreach ($p in $names) { do { Start-Sleep -Seconds 30; $run = Get-LastRun $p;"
+        + " $result = ($run.stages | Where-Object name -eq 'build_ppls').result }"
+        + " while ($run.counter -le $before[$p] -or $result -notin @('Passed', 'Failed', 'Cancelled'));"
+        + " if ($result -ne 'Passed') { $failed += $p } }",
+        "if ($failed) { throw ('Failed to build: ' + ($failed -join ', ')) }",
+    ]
+)
+
+trigger_wave_tasks = [
+    {
+        "exec": {
+            "run_if": "passed",
+            "command": "powershell",
+            "arguments": ["-NoProfile", "-Command", trigger_wave_script],
+        }
+    }
+]
+
+
+def generateRebuildAllPipeline(buildPlan):
+    # One stage per wave, each triggering all of the wave's pipelines at once
+    # and passing only when all of them have been built. The pipelines' own
+    # build_ppls stages keep their manual approval, so the waves are ordered
+    # by this pipeline rather than by the dependency materials.
+    stages = []
+    for wave in buildPlan["waves"]:
+        stages.append(
+            {
+                f"wave_{wave['wave']:02d}": {
+                    "approval": "manual" if wave["wave"] == 0 else "success",
+                    "fetch_materials": "no",
+                    "resources": ["powershell"],
+                    "timeout": 0,  # Waits for the wave's builds, however long
+                    "environment_variables": {
+                        "TRIGGER_PIPELINES": " ".join(wave["pipelines"])
+                    },
+                    # Single job, so no need for jobs entry
+                    "tasks": trigger_wave_tasks,
+                }
+            }
+        )
+    return {
+        "group": "PPLs",
+        "materials": {"builder": builderMaterial},
+        "environment_variables": {
+            "GOCD_API_TOKEN": "{{SECRET:[secrets.json][gocd_api_token]}}"
+        },
+        "stages": stages,
+    }